@@ -26,17 +26,58 @@ from pcbnew import * # Pcbnew-KiCad library channel.
 
 import sys, os, os.path # OS and directories.
 import re
+import io
+import csv
+import math
+import heapq
+import fnmatch
+from bisect import bisect_left
+import json
+import tempfile
+import hashlib
+import mmap
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import wx
 import wx.lib.filebrowsebutton as FBB
 
 import traceback
 
 WIDGET_SPACING = 5
+PREVIEW_DELAY = 300  # Milliseconds to wait after the last edit before updating the live preview.
+SYMBOL_CACHE_SIZE = 64 * 1024 * 1024  # Approximate limit in bytes on the memory used by cached symbols.
+BOARD_UNIT = 'Any'  # Unit of the pins found on a board without a netlist, since pads don't store units.
+IU_PER_MM = 1000000.0  # PCBNEW positions are in nanometers.
+
+# Labels and library codes for the electrical functions of pins.
+PIN_FUNCS = {
+    'In': 'I',
+    'Out': 'O',
+    'I/O': 'B',
+    'Pwr In': 'W',
+    'Pwr Out': 'w',
+    'Passive': 'P',
+    '3-State': 'T',
+    'OpenColl': 'C',
+    'OpenEmit': 'E',
+    'Unspec': 'U',
+    'NC': 'N',
+}
+
+# Labels and codes for the connection states of pins.
+PIN_STATES = {
+    'Connected': 'C',
+    'Unconnected': 'U',
+}
 
 
 def debug_dialog(msg, exception=None):
     if exception:
-        msg = '\n'.join((msg, str(exception), traceback.format.exc()))
+        msg = '\n'.join((msg, str(exception), traceback.format_exc()))
     dlg = wx.MessageDialog(None, msg, '', wx.OK)
     dlg.ShowModal()
     dlg.Destroy()
@@ -103,17 +144,65 @@ class LabelledTextCtrl(wx.BoxSizer):
         self.AddSpacer(WIDGET_SPACING)
 
 
-class LabelledListBox(wx.BoxSizer):
-    '''ListBox with label.'''
+class UnitList(wx.ListCtrl):
+    '''Virtual list of part units.
 
-    def __init__(self, parent, label, choices, tooltip=''):
+    The control only asks for the text of the rows it displays, so setting
+    thousands of units or selecting all of them takes a single call.
+    '''
+
+    def __init__(self, parent):
+        wx.ListCtrl.__init__(
+            self,
+            parent=parent,
+            style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_NO_HEADER,
+            size=wx.Size(1, 80))
+        self.InsertColumn(0, '')
+        self.items = []
+        self.Bind(wx.EVT_SIZE, self.OnSize)
+
+    def OnGetItemText(self, item, col):
+        return self.items[item]
+
+    def OnSize(self, evt):
+        self.SetColumnWidth(0, self.GetClientSize().width)
+        evt.Skip()
+
+    def SetItems(self, items, selected=None):
+        '''Replace the items and select all of them, or only those in selected.'''
+        self.SetItemState(-1, 0, wx.LIST_STATE_SELECTED)
+        self.items = list(items)
+        self.SetItemCount(len(self.items))
+        if selected is None:
+            if self.items:
+                # An index of -1 selects every item at once.
+                self.SetItemState(-1, wx.LIST_STATE_SELECTED, wx.LIST_STATE_SELECTED)
+        else:
+            selected = set(selected)
+            for i, item in enumerate(self.items):
+                if item in selected:
+                    self.Select(i)
+        self.Refresh()
+
+    def GetSelectedItems(self):
+        '''Return the selected items.'''
+        if self.GetSelectedItemCount() == len(self.items):
+            return list(self.items)
+        selected = []
+        i = self.GetFirstSelected()
+        while i != -1:
+            selected.append(self.items[i])
+            i = self.GetNextSelected(i)
+        return selected
+
+
+class LabelledUnitList(wx.BoxSizer):
+    '''List of units with a label.'''
+
+    def __init__(self, parent, label, tooltip=''):
         wx.BoxSizer.__init__(self, wx.HORIZONTAL)
         self.lbl = wx.StaticText(parent=parent, label=label)
-        self.lbx = wx.ListBox(
-            parent=parent,
-            choices=choices,
-            style=wx.LB_EXTENDED | wx.LB_NEEDED_SB | wx.LB_SORT,
-            size=wx.Size(1, 50))
+        self.lbx = UnitList(parent)
         self.lbx.SetToolTip(wx.ToolTip(tooltip))
         self.AddSpacer(WIDGET_SPACING)
         self.Add(self.lbl, 0, wx.ALL | wx.ALIGN_TOP)
@@ -124,134 +213,1946 @@ class LabelledListBox(wx.BoxSizer):
 
 class Part(object):
     '''Object for storing part symbol data.'''
-    pass
+    __slots__ = ('ref', 'lib', 'part', 'lib_file', 'lib_stamp', 'pins', 'units', 'pin_table')
 
 
 class Pin(object):
     '''Object for storing pin data.'''
-    pass
+    __slots__ = ('num', 'name', 'func', 'unit')
+
+    def __init__(self, num, name, func, unit):
+        self.num = num
+        self.name = name
+        # Functions and units are repeated across thousands of pins, so share
+        # a single copy of each string.
+        self.func = sys.intern(func)
+        self.unit = sys.intern(unit)
+
+
+class Stats(object):
+    '''Time spent in each stage of PadPainter's operations and counts of cache hits and misses.
+
+    Each timed stage is also appended to a log file if one is set (initially
+    from the PADPAINTER_LOG environment variable).
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()  # Stages are timed in several threads.
+        self.times = OrderedDict()  # [# calls, total secs, last secs] indexed by stage.
+        self.counts = OrderedDict()  # Number of events indexed by name.
+        self.log_file = os.environ.get('PADPAINTER_LOG') or None
+
+    @contextmanager
+    def timer(self, stage):
+        '''Time the code in a with-block as a stage.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, secs):
+        '''Add the time taken by one call of a stage.'''
+        with self.lock:
+            entry = self.times.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += secs
+            entry[2] = secs
+        self.log('{} {:.3f} ms'.format(stage, secs * 1000))
+
+    def count(self, name, n=1):
+        '''Add to the number of times an event happened.'''
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def log(self, msg):
+        '''Append a time-stamped message to the log file, if there is one.'''
+        if not self.log_file:
+            return
+        try:
+            with open(self.log_file, 'a') as fp:
+                fp.write('{} {}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'), msg))
+        except (IOError, OSError):
+            # Logging must never break the operation being logged.
+            pass
+
+    def reset(self):
+        '''Discard all the times and counts.'''
+        with self.lock:
+            self.times.clear()
+            self.counts.clear()
+        symbol_cache.hits = symbol_cache.misses = 0
+
+    def report(self):
+        '''Return a table of the times and counts as text.'''
+        lines = ['{:<16} {:>6} {:>10} {:>10}'.format('Stage', 'Calls', 'Last ms', 'Total ms')]
+        with self.lock:
+            for stage, (calls, total, last) in self.times.items():
+                lines.append('{:<16} {:>6} {:>10.1f} {:>10.1f}'.format(
+                    stage, calls, last * 1000, total * 1000))
+            counts = list(self.counts.items())
+        counts.append(('symbol cache hit', symbol_cache.hits))
+        counts.append(('symbol cache miss', symbol_cache.misses))
+        lines.append('')
+        for name, n in counts:
+            lines.append('{:<28} {:>10}'.format(name, n))
+        return '\n'.join(lines)
+
+
+# Timings and counters for all of PadPainter's operations.
+stats = Stats()
+
+
+def get_file_stamp(file_name):
+    '''Return the modification time and size of a file for detecting changes.'''
+    st = os.stat(file_name)
+    return [st.st_mtime, st.st_size]
+
+
+def get_file_hash(file_name):
+    '''Return a hash of the contents of a file.'''
+    hasher = hashlib.sha1()
+    with open(file_name, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def write_json_file(file_name, data, **kwargs):
+    '''Write data to a JSON file so readers only ever see the old or the new file, never part of one.'''
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(file_name) or '.',
+                                    prefix=os.path.basename(file_name) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(data, fp, **kwargs)
+        os.replace(tmp_file, file_name)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
 
 
-def get_parts_from_netlist(netlist_file):
-    '''Get part information from a netlist file.'''
+class NetlistCache(object):
+    '''Parsed netlists stored in memory and in a sidecar file next to the PCB.'''
 
-    # Get the local and global files that contain the symbol tables.
-    # Place the global file first so its entries will be overridden by any
-    # matching entries in the local file.
-    sym_lib_tbl_files = []  # Store the symbol table file paths here.
-    brd_file = GetBoard().GetFileName()
+    version = 3  # Bump this whenever the format of the cached data changes.
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.lock = threading.RLock()  # Held while using the entries, which part loaders share with the GUI.
+        self.entries = {}  # Parsed netlists indexed by absolute file path.
+        try:
+            with open(cache_file, 'r') as fp:
+                data = json.load(fp)
+            if data.get('version') == self.version:
+                self.entries = data['netlists']
+        except (IOError, OSError, ValueError, KeyError):
+            # No usable sidecar file, so start with an empty cache.
+            pass
+
+    def save(self):
+        '''Write the cached netlists to the sidecar file.'''
+        try:
+            with self.lock:
+                write_json_file(self.cache_file, {'version': self.version, 'netlists': self.entries})
+        except (IOError, OSError):
+            # The cache is only an optimization, so ignore unwritable directories.
+            pass
+
+    def get_entry(self, netlist_file):
+        '''Return the cache entry for a netlist, discarding it if the file has changed.
+
+        The lock is only held while the entries are used, never while a file
+        is read, so a part loader reading a netlist doesn't hold up the GUI.
+        '''
+
+        netlist_file = os.path.abspath(netlist_file)
+        stamp = get_file_stamp(netlist_file)
+        with self.lock:
+            entry = self.entries.get(netlist_file)
+
+            # The netlist is unchanged if its modification time and size are the same.
+            if entry and entry['stamp'] == stamp:
+                stats.count('netlist cache hit')
+                return entry
+
+        # Otherwise, the netlist is unchanged if its contents are the same
+        # (e.g., it was just touched or copied) so update the stamp and keep it.
+        file_hash = get_file_hash(netlist_file)
+        with self.lock:
+            entry = self.entries.get(netlist_file)
+            if entry and entry['hash'] == file_hash:
+                if entry['stamp'] != stamp:
+                    entry['stamp'] = stamp
+                    self.save()
+                stats.count('netlist cache hit')
+                return entry
+
+            # The netlist really changed, so start a new entry for it.
+            stats.count('netlist cache miss')
+            entry = {'stamp': stamp, 'hash': file_hash}
+            self.entries[netlist_file] = entry
+            return entry
+
+    def get_section(self, netlist_file, key, parse, stage):
+        '''Return a section of a netlist stored under a key in its entry, only parsing it if it isn't there.'''
+        entry = self.get_entry(netlist_file)
+        with self.lock:
+            if key in entry:
+                return entry[key]
+
+        # Parse the netlist without the lock and only store the result under it,
+        # unless the netlist changed again in the meantime.
+        with stats.timer(stage):
+            section = parse(netlist_file)
+        with self.lock:
+            if self.entries.get(os.path.abspath(netlist_file)) is entry:
+                entry[key] = section
+                self.save()
+        return section
+
+    def get(self, netlist_file):
+        '''Return the parts in the netlist, only reparsing it if the file has changed.'''
+        return self.get_section(netlist_file, 'parts', parse_netlist, 'parse parts')
+
+    def get_nets(self, netlist_file):
+        '''Return the nets in the netlist, only reparsing it if the file has changed.'''
+        return self.get_section(netlist_file, 'nets', parse_netlist_nets, 'parse nets')
+
+
+# Netlist caches for each PCB, indexed by the path to their sidecar files.
+netlist_caches = {}
+
+
+def get_netlist_cache(brd_file):
+    '''Return the netlist cache associated with a PCB file.'''
     brd_dir = os.path.abspath(os.path.dirname(brd_file))
     brd_name = os.path.splitext(os.path.basename(brd_file))[0]
+    cache_file = os.path.join(brd_dir, brd_name + '-padpainter.cache')
+    try:
+        return netlist_caches[cache_file]
+    except KeyError:
+        # Part loaders can get here at the same time, so they must all end up with the same cache.
+        return netlist_caches.setdefault(cache_file, NetlistCache(cache_file))
+
+
+def get_kicad_config_dir():
+    '''Return the directory holding KiCad's global configuration files.
+
+    Newer versions of KiCad keep their files in a subdirectory for each version,
+    so the newest one with a global symbol library table is used.
+    '''
     if sys.platform == 'win32':
         default_home = os.path.expanduser(r'~\AppData\Roaming\kicad')
     else:
         default_home = os.path.expanduser(r'~/.config/kicad')
-    dirs = [os.environ.get('KICAD_CONFIG_HOME', default_home), brd_dir]
-    for dir in dirs:
-        sym_lib_tbl_file = os.path.join(dir, 'sym-lib-table')
-        if os.path.isfile(sym_lib_tbl_file):
-            sym_lib_tbl_files.append(sym_lib_tbl_file)
+    config_home = os.environ.get('KICAD_CONFIG_HOME', default_home)
+    if os.path.isfile(os.path.join(config_home, 'sym-lib-table')):
+        return config_home
+    try:
+        versions = sorted(
+            (d for d in os.listdir(config_home)
+             if re.match(r'^\d+(\.\d+)*$', d) and
+             os.path.isfile(os.path.join(config_home, d, 'sym-lib-table'))),
+            key=lambda d: [int(v) for v in d.split('.')])
+    except OSError:
+        versions = []
+    if versions:
+        return os.path.join(config_home, versions[-1])
+    return config_home
+
+
+def read_sym_lib_table(tbl_file):
+    '''Return a list of the (library name, URI) entries in a symbol library table file.'''
+    entries = []
+    with open(tbl_file, 'r') as fp:
+        tokens = tokenize_sexp(fp)
+        if next(tokens, None) is not SEXP_OPEN:
+            return entries
+        next(tokens, None)  # Skip the sym_lib_table keyword.
+        for token in tokens:
+            if token is SEXP_CLOSE:
+                break
+            if token is not SEXP_OPEN:
+                continue
+            lib = read_sexp(tokens)
+            if lib and lib[0] == 'lib':
+                name, uri = sexp_value(lib, 'name'), sexp_value(lib, 'uri')
+                if name is not None and uri is not None:
+                    entries.append((name, uri))
+    return entries
+
+
+def read_kicad_path_vars(config_dir):
+    '''Return the path variables (e.g., KICAD_SYMBOL_DIR) set in KiCad's configuration.'''
+
+    path_vars = {}
+
+    # Newer versions of KiCad store the variables in a JSON file.
+    try:
+        with open(os.path.join(config_dir, 'kicad_common.json'), 'r') as fp:
+            path_vars.update(json.load(fp)['environment']['vars'] or {})
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    # Older versions store them in a section of an INI-style file.
+    try:
+        with open(os.path.join(config_dir, 'kicad_common'), 'r') as fp:
+            in_section = False
+            for line in fp:
+                line = line.strip()
+                if line.startswith('['):
+                    in_section = line == '[EnvironmentVariables]'
+                elif in_section and '=' in line:
+                    name, value = line.split('=', 1)
+                    path_vars.setdefault(name.strip(), value.strip())
+    except (IOError, OSError):
+        pass
+
+    return path_vars
+
+
+def expand_kicad_vars(uri, path_vars):
+    '''Replace ${VAR} and $(VAR) in a library URI with the values of KiCad path variables.'''
+    def replace(mtch):
+        name = mtch.group(1) or mtch.group(2)
+        return path_vars.get(name, mtch.group(0))
+    return re.sub(r'\$\{(\w+)\}|\$\((\w+)\)', replace, uri)
+
 
-    # Regular expression for getting the symbol library name and file location
-    # from the symbol table file.
-    sym_tbl_re = '\(\s*lib\s+\(\s*name\s+([^)]+)\s*\).*\(\s*uri\s+([^)]+)\s*\)'
+# Symbol library files resolved from the symbol library tables, indexed by the
+# PCB file, the stamps of the table and configuration files and the environment.
+sym_lib_files_cache = {}
+
+
+def get_sym_lib_files(brd_file):
+    '''Return a dict of symbol library names and their file locations.
+
+    The result is cached until the global or project symbol library table,
+    KiCad's configuration or the environment changes. Libraries whose files
+    are missing are kept, so check that a file exists when it's looked up.
+    '''
+
+    # Get the local and global files that contain the symbol tables.
+    # Place the global file first so its entries will be overridden by any
+    # matching entries in the local file.
+    brd_dir = os.path.abspath(os.path.dirname(brd_file))
+    brd_name = os.path.splitext(os.path.basename(brd_file))[0]
+    config_dir = get_kicad_config_dir()
+    sym_lib_tbl_files = [
+        os.path.join(dir, 'sym-lib-table') for dir in (config_dir, brd_dir)
+    ]
+    config_files = [
+        os.path.join(config_dir, name) for name in ('kicad_common.json', 'kicad_common')
+    ]
+    rescue_files = [
+        os.path.join(brd_dir, brd_name + lib_type + '.lib')
+        for lib_type in ('-cache', '-rescue')
+    ]
+
+    # Reuse the previous result if none of the files it came from have changed.
+    stamps = []
+    for file_name in sym_lib_tbl_files + config_files + rescue_files:
+        try:
+            stamps.append((file_name, tuple(get_file_stamp(file_name))))
+        except OSError:
+            stamps.append((file_name, None))
+    # The environment variables are part of the key because they override
+    # the path variables in the library URIs.
+    key = (brd_file, tuple(stamps), tuple(sorted(os.environ.items())))
+    try:
+        sym_lib_files = sym_lib_files_cache[key]
+        stats.count('sym-lib cache hit')
+        return dict(sym_lib_files)
+    except KeyError:
+        stats.count('sym-lib cache miss')
+    start = time.perf_counter()
+
+    # Get the values of the path variables used in the library URIs. Environment
+    # variables override the configuration, and ${KIPRJMOD} is the PCB directory.
+    path_vars = read_kicad_path_vars(config_dir)
+    path_vars.update(os.environ)
+    path_vars['KIPRJMOD'] = brd_dir
 
     # Process the global and local symbol library tables to create a dict
     # of the symbol library names and their file locations.
     sym_lib_files = {}
     for tbl_file in sym_lib_tbl_files:
-        with open(tbl_file, 'r') as fp:
-            for line in fp:
-                srch_result = re.search(sym_tbl_re, line)
-                if srch_result:
-                    lib_name, lib_uri = srch_result.group(1, 2)
-                    sym_lib_files[lib_name.lower()] = os.path.expandvars(
-                        lib_uri)
+        if not os.path.isfile(tbl_file):
+            continue
+        for lib_name, lib_uri in read_sym_lib_table(tbl_file):
+            lib_file = expand_kicad_vars(lib_uri, path_vars)
+            if not os.path.isabs(lib_file):
+                lib_file = os.path.join(os.path.dirname(tbl_file), lib_file)
+            sym_lib_files[lib_name.lower()] = os.path.normpath(lib_file)
 
     # Add any cache or rescue libraries in the PCB directory.
-    for lib_type in ['-cache', '-rescue']:
-        lib_name = brd_name + lib_type
-        file_name = os.path.join(brd_dir, lib_name + '.lib')
+    for file_name in rescue_files:
         if os.path.isfile(file_name):
+            lib_name = os.path.splitext(os.path.basename(file_name))[0]
             sym_lib_files[lib_name.lower()] = file_name
 
-    # Regular expressions for getting the part reference and symbol library
-    # from the netlist file.
-    comp_ref_re = '\(\s*comp\s+\(\s*ref\s+([_A-Za-z][_A-Za-z0-9]*)\s*\)'
-    comp_lib_re = '\(\s*libsource\s+\(\s*lib\s+([^)]+)\s*\)\s+\(\s*part\s+([^)]+)\s*\)\s*\)'
+    sym_lib_files_cache[key] = sym_lib_files
+    stats.record('resolve sym-lib', time.perf_counter() - start)
+    return dict(sym_lib_files)
+
+
+# Unique markers for the parentheses produced by the S-expression tokenizer.
+SEXP_OPEN = object()
+SEXP_CLOSE = object()
+
+# Regular expression for the next parenthesis, quoted string or atom in an S-expression.
+sexp_token_re = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+
+def tokenize_sexp(fp, chunk_size=1 << 16):
+    '''Generate the tokens of an S-expression read from a file a chunk at a time.
+
+    Parentheses are returned as SEXP_OPEN and SEXP_CLOSE and everything else
+    as strings with any quotes removed. Only the current chunk is kept in
+    memory regardless of the size of the file.
+    '''
+
+    buf = ''
+    while True:
+        chunk = fp.read(chunk_size)
+        buf += chunk
+        end = len(buf)
+        pos = 0
+        while True:
+            mtch = sexp_token_re.match(buf, pos)
+            if not mtch:
+                # Only whitespace or an unfinished string remains in the buffer.
+                break
+            if chunk and mtch.end() == end:
+                # The token might continue into the next chunk.
+                break
+            pos = mtch.end()
+            if mtch.group(1):
+                yield SEXP_OPEN
+            elif mtch.group(2):
+                yield SEXP_CLOSE
+            elif mtch.group(3) is not None:
+                string = mtch.group(3)
+                if '\\' in string:
+                    string = re.sub(r'\\(.)', r'\1', string)
+                yield string
+            else:
+                yield mtch.group(4)
+        buf = buf[pos:]
+        if not chunk:
+            break
+
+
+def read_sexp(tokens):
+    '''Return the rest of an S-expression as nested lists once its opening parenthesis has been read.'''
+    stack = [[]]
+    for token in tokens:
+        if token is SEXP_OPEN:
+            stack.append([])
+        elif token is SEXP_CLOSE:
+            sexp = stack.pop()
+            if not stack:
+                return sexp
+            stack[-1].append(sexp)
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+
+def skip_sexp(tokens):
+    '''Skip the rest of an S-expression once its opening parenthesis has been read.'''
+    depth = 1
+    for token in tokens:
+        if token is SEXP_OPEN:
+            depth += 1
+        elif token is SEXP_CLOSE:
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def sexp_value(sexp, key):
+    '''Return the first value of the sub-expression with the given key, or None.'''
+    for item in sexp:
+        if isinstance(item, list) and item and item[0] == key:
+            return item[1] if len(item) > 1 else None
+    return None
+
+
+def read_netlist_section(netlist_file, section):
+    '''Generate the expressions in a top-level section of a netlist as nested lists.
+
+    Each expression is read when it's requested so memory use stays constant,
+    and the rest of the netlist is not read once the section ends.
+    '''
+
+    with open(netlist_file, 'r') as fp:
+        tokens = tokenize_sexp(fp)
+
+        # Enter the top-level (export ...) expression.
+        for token in tokens:
+            if token is SEXP_OPEN:
+                next(tokens, None)
+                break
+
+        # Go through the sections of the netlist until the desired one is found.
+        for token in tokens:
+            if token is SEXP_CLOSE:
+                return  # End of the netlist.
+            if token is not SEXP_OPEN:
+                continue
+            if next(tokens, None) != section:
+                skip_sexp(tokens)
+                continue
+
+            # Return each expression in the section.
+            for token in tokens:
+                if token is SEXP_CLOSE:
+                    return  # End of the section.
+                if token is SEXP_OPEN:
+                    yield read_sexp(tokens)
+            return
+
+
+def parse_netlist(netlist_file):
+    '''Return a dict of the symbol library and part name for each part reference in a netlist.'''
 
-    # Scan through the netlist searching for the part references and libraries.
     parts = {}
-    with open(netlist_file, 'r') as fp:
-        for line in fp:
-
-            # Search for part reference.
-            srch_result = re.search(comp_ref_re, line)
-            if srch_result:
-                ref = srch_result.group(1)
-                parts[ref] = None  # Create a dict entry to hold the part.
-                continue  # Reference found, so continue with next line.
-
-            # Search for symbol library associated with the part reference.
-            srch_result = re.search(comp_lib_re, line)
-            if srch_result:
-                part = Part()
-                part.lib = srch_result.group(1).lower()
-                part.part = srch_result.group(2)
-                part.ref = ref
-                parts[ref] = part
-                continue  # Library found, so continue with next line.
-
-    # For each symbol, store the path to the file associated with that symbol's library.
-    for part in parts.values():
-        if part:
-            part.lib_file = sym_lib_files.get(part.lib, None)
+    for comp in read_netlist_section(netlist_file, 'components'):
+        if not comp or comp[0] != 'comp':
+            continue
+        ref = sexp_value(comp, 'ref')
+        if ref is None:
+            continue
+        parts[ref] = None  # Create a dict entry to hold the part.
+        for item in comp:
+            if isinstance(item, list) and item and item[0] == 'libsource':
+                lib = sexp_value(item, 'lib')
+                part = sexp_value(item, 'part')
+                if lib is not None and part is not None:
+                    parts[ref] = [lib.lower(), part]
+    return parts
+
+
+def parse_netlist_nets(netlist_file):
+    '''Return a dict of the (reference, pin) nodes attached to each net in a netlist.'''
+
+    nets = {}
+    for net in read_netlist_section(netlist_file, 'nets'):
+        if not net or net[0] != 'net':
+            continue
+        name = sexp_value(net, 'name')
+        if name is None:
+            continue
+        nets[name] = [
+            [sexp_value(node, 'ref'), sexp_value(node, 'pin')]
+            for node in net
+            if isinstance(node, list) and node and node[0] == 'node'
+        ]
+    return nets
+
+
+class NetIndex(object):
+    '''Connections between nets and part pins from the (nets ...) section of a netlist.'''
+
+    def __init__(self, nets):
+        self.nodes = {}  # List of (reference, pin) nodes indexed by net name.
+        self.pin_nets = {}  # Net names indexed by (reference, pin).
+        self.ref_nets = {}  # Set of net names attached to each part reference.
+        for net, nodes in nets.items():
+            nodes = [tuple(node) for node in nodes]
+            self.nodes[net] = nodes
+            for node in nodes:
+                self.pin_nets[node] = net
+                self.ref_nets.setdefault(node[0], set()).add(net)
+
+    def fanout(self, net):
+        '''Return the number of pins attached to a net.'''
+        return len(self.nodes.get(net, ()))
+
+    def is_connected(self, ref, pin):
+        '''Return True if a part pin is attached to a net with other pins.'''
+        net = self.pin_nets.get((ref, pin))
+        # Newer versions of KiCad put unconnected pins on placeholder nets,
+        # and older ones put each of them on a net of its own (e.g., 'Net-(U4-PadN14)').
+        return net is not None and not net.startswith('unconnected-') and self.fanout(net) > 1
+
+
+def get_parts_from_netlist(netlist_file, brd_file=None):
+    '''Get part information from a netlist file.'''
+
+    if brd_file is None:
+        brd_file = GetBoard().GetFileName()
+
+    sym_lib_files = get_sym_lib_files(brd_file)
+
+    # Get the symbol library and part name for each part reference. The netlist
+    # is only parsed if it has changed since the last time it was used.
+    netlist_parts = get_netlist_cache(brd_file).get(netlist_file)
+
+    # Create a part object for each reference and store the path to the file
+    # associated with that symbol's library. The library tables can have
+    # hundreds of entries, so only the files of the libraries that are used
+    # are checked, and only once each. They're checked every time because a
+    # missing library may have been installed since the tables were read.
+    lib_files = {}
+    parts = {}
+    for ref, lib_part in netlist_parts.items():
+        if lib_part:
+            part = Part()
+            part.lib, part.part = lib_part
+            part.ref = ref
+            if part.lib not in lib_files:
+                lib_file = sym_lib_files.get(part.lib, None)
+                lib_files[part.lib] = lib_file if lib_file and os.path.isfile(lib_file) else None
+            part.lib_file = lib_files[part.lib]
+            parts[ref] = part
+        else:
+            parts[ref] = None
 
     return parts
 
 
-def fillin_part_info_from_lib(ref, parts):
+class NetlistNetIndex(NetIndex):
+    '''Net index of a netlist file that isn't built until one of its connections is looked up.
+
+    Reading the (nets ...) section of a large netlist takes as long as reading
+    its parts, so it's skipped unless some criteria actually need the nets.
+    '''
+
+    def __init__(self, netlist_file, brd_file):
+        self.netlist_file = netlist_file
+        self.brd_file = brd_file
+
+    def __getattr__(self, name):
+        # Only called for missing attributes, so this builds the index on first use.
+        if name not in ('nodes', 'pin_nets', 'ref_nets'):
+            raise AttributeError(name)
+        NetIndex.__init__(self, get_netlist_cache(self.brd_file).get_nets(self.netlist_file))
+        return self.__dict__[name]
+
+    def is_loaded(self):
+        '''Return True if the nets of the netlist have been read.'''
+        return 'nodes' in self.__dict__
+
+
+def get_net_index(netlist_file, brd_file=None):
+    '''Get the connections between nets and part pins from a netlist file, reading them when first needed.'''
+    if brd_file is None:
+        brd_file = GetBoard().GetFileName()
+    return NetlistNetIndex(netlist_file, brd_file)
+
+
+def natural_key(text):
+    '''Return a key that sorts strings with numbers in numerical order (e.g., U2 before U10).'''
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', text)]
+
+
+# Characters that make a part reference a wildcard or regular expression pattern.
+ref_wildcard_re = re.compile(r'[*?[]')
+ref_regex_re = re.compile(r'[+(){}|\\^$.]')
+
+
+class RefIndex(object):
+    '''Sorted part references for selecting parts with patterns.
+
+    A pattern with only the *, ? and [] wildcards is matched like a file name
+    (e.g., J*). A pattern with any other regular expression characters is
+    matched as a regular expression (e.g., U[0-9]+). Anything else is an exact
+    reference. Only the references that start with the literal beginning of a
+    pattern are tested against it.
+    '''
+
+    def __init__(self, refs):
+        self.refs = sorted(refs)
+
+    def match(self, pattern):
+        '''Return the references that match a pattern in numerical order.'''
+
+        wildcard = ref_wildcard_re.search(pattern)
+        regex = ref_regex_re.search(pattern)
+        if not (wildcard or regex):
+            return [pattern]
+
+        # Find the literal characters at the start of the pattern. In a regular
+        # expression, a quantifier applies to the character before it and an
+        # alternation can start with anything.
+        meta = min(m.start() for m in (wildcard, regex) if m)
+        prefix = pattern[:meta]
+        if regex:
+            if '|' in pattern:
+                prefix = ''
+            elif pattern[meta] in '*?+{':
+                prefix = prefix[:-1]
+            ref_re = re.compile(pattern)
+        else:
+            ref_re = re.compile(fnmatch.translate(pattern))
+
+        matched = []
+        for i in range(bisect_left(self.refs, prefix), len(self.refs)):
+            ref = self.refs[i]
+            if not ref.startswith(prefix):
+                break
+            if ref_re.fullmatch(ref):
+                matched.append(ref)
+        return sorted(matched, key=natural_key)
+
+    def expand(self, patterns):
+        '''Return the references matching a list of patterns, in order and without duplicates.'''
+        refs = []
+        for pattern in patterns:
+            refs.extend(self.match(pattern))
+        return list(dict.fromkeys(refs))
+
+
+def get_rule_refs(rule, parts, ref_index=None):
+    '''Return the part references selected by the patterns in a rule.'''
+    if ref_index is None:
+        ref_index = RefIndex(parts)
+    return ref_index.expand(split_list(rule.get('parts', [])))
+
+
+class Symbol(object):
+    '''Object for storing the pins and units of a library symbol.'''
+    __slots__ = ('pins', 'units', 'pin_table')
+
+
+class PinTable(object):
+    '''Pin attributes of a symbol stored in columns so criteria can be applied to all pins at once.'''
+    __slots__ = ('nums', 'names', 'funcs', 'units', 'groups', '__weakref__')
+
+    def __init__(self, pins):
+        pins = list(pins.values())
+        self.nums = tuple(pin.num for pin in pins)
+        self.names = tuple(pin.name for pin in pins)
+        self.funcs = tuple(pin.func for pin in pins)
+        self.units = tuple(pin.unit for pin in pins)
+
+        # Rows of the table for each combination of unit and function so the
+        # pins in the selected units and functions are found without a scan.
+        groups = {}
+        for row, key in enumerate(zip(self.units, self.funcs)):
+            groups.setdefault(key, []).append(row)
+        self.groups = {key: tuple(rows) for key, rows in groups.items()}
+
+
+# Pin tables indexed by their columns so symbols with the same pins share one,
+# whether they came from a library, the pin cache or the board.
+pin_tables = weakref.WeakValueDictionary()
+pin_tables_lock = threading.Lock()  # Pin tables are made in several threads.
+
+
+def get_pin_table(pins):
+    '''Return a pin table for a dict of pins, shared with any other symbol that has the same pins.
+
+    Parts with the same pins can then be recognized by their pin table, and
+    the pins a pad filter matches in it are only found once.
+    '''
+    table = PinTable(pins)
+    key = (table.nums, table.names, table.funcs, table.units)
+    with pin_tables_lock:
+        return pin_tables.setdefault(key, table)
+
+
+def estimate_symbol_size(symbol):
+    '''Return the approximate number of bytes of memory used by a symbol.'''
+    size = sys.getsizeof(symbol.pins) + sys.getsizeof(symbol.units)
+    for pin in symbol.pins.values():
+        size += sys.getsizeof(pin) + sys.getsizeof(pin.num) + sys.getsizeof(pin.name)
+    # The pin table holds four columns of references to the same strings.
+    size += 4 * sys.getsizeof(symbol.pin_table.nums) + sys.getsizeof(symbol.pin_table.groups)
+    return size
+
+
+class SymbolCache(object):
+    '''Least-recently-used cache of parsed symbols with a limit on the memory they use.'''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (symbol, size) indexed by key, oldest first.
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # Symbols are loaded from several threads.
+
+    def get(self, key):
+        '''Return the symbol stored with a key, or None if it's not in the cache.'''
+        with self.lock:
+            try:
+                symbol, _ = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return symbol
+
+    def put(self, key, symbol):
+        '''Store a symbol, evicting the least-recently-used ones if the cache is too big.'''
+        size = estimate_symbol_size(symbol)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (symbol, size)
+            self.total_bytes += size
+            # Always keep the newest symbol, even if it's bigger than the limit.
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+
+    def clear(self):
+        '''Remove all the symbols.'''
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+# Symbols parsed from all the libraries, indexed by library file, byte range
+# and the library's modification stamp.
+symbol_cache = SymbolCache(SYMBOL_CACHE_SIZE)
+
+
+def get_cache_dir():
+    '''Return the directory for storing the indexes of symbol libraries.'''
+    cache_dir = os.environ.get('PADPAINTER_CACHE_DIR')
+    if not cache_dir:
+        if sys.platform == 'win32':
+            base_dir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            base_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+        cache_dir = os.path.join(base_dir, 'padpainter')
+    return cache_dir
+
+
+class IndexedLibrary(object):
+    '''Base class for symbol libraries accessed through an index of the byte range of each symbol.
+
+    The index is stored in the cache directory and only rebuilt when the
+    library file changes. Symbols are parsed when they're first requested by
+    reading just their bytes from a memory-mapped view of the library, and
+    are kept in the shared symbol cache. Subclasses provide build_index()
+    and parse_symbol().
+    '''
+
+    index_version = 1  # Bump this whenever the format of the stored index changes.
+
+    def __init__(self, lib_file):
+        self.lib_file = lib_file
+        self.stamp = get_file_stamp(lib_file)
+        self.offsets = {}  # Byte range of each symbol indexed by name and alias.
+
+        if self.load_index():
+            stats.count('library index hit')
+            return
+        stats.count('library index miss')
+        with stats.timer('index library'):
+            with open(lib_file, 'rb') as fp:
+                try:
+                    data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    data = b''  # Empty files can't be memory-mapped.
+                try:
+                    self.build_index(data)
+                finally:
+                    if data:
+                        data.close()
+            self.save_index()
+
+    def index_file(self):
+        '''Return the path to the file where the library's index is stored.'''
+        key = hashlib.sha1(self.lib_file.encode('utf-8')).hexdigest()
+        return os.path.join(get_cache_dir(), key + '.json')
+
+    def load_index(self):
+        '''Load the stored index, returning False if it's missing or out of date.'''
+        try:
+            with open(self.index_file(), 'r') as fp:
+                data = json.load(fp)
+            if (data['version'] != self.index_version or data['lib_file'] != self.lib_file
+                    or data['stamp'] != self.stamp):
+                return False
+            self.offsets = {name: tuple(rng) for name, rng in data['offsets'].items()}
+            return True
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+
+    def save_index(self):
+        '''Store the index so it doesn't have to be rebuilt next time.'''
+        index_file = self.index_file()
+        try:
+            if not os.path.isdir(os.path.dirname(index_file)):
+                os.makedirs(os.path.dirname(index_file))
+            write_json_file(index_file, {
+                'version': self.index_version,
+                'lib_file': self.lib_file,
+                'stamp': self.stamp,
+                'offsets': self.offsets,
+            })
+        except (IOError, OSError):
+            # The index is only an optimization, so ignore unwritable directories.
+            pass
+
+    def read_text(self, start, end):
+        '''Return the text in a byte range of the library file.'''
+        with open(self.lib_file, 'rb') as fp:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return data[start:end].decode('utf-8', 'replace')
+            finally:
+                data.close()
+
+    def get_symbol(self, name):
+        '''Return the symbol with the given name or alias, or None if it's not in the library.'''
+        try:
+            rng = self.offsets[name]
+        except KeyError:
+            return None
+
+        # Aliases share the byte range of their symbol, so they share the
+        # cached symbol as well.
+        key = (self.lib_file, rng, tuple(self.stamp))
+        symbol = symbol_cache.get(key)
+        if symbol is None:
+            with stats.timer('load symbol'):
+                symbol = self.parse_symbol(self.read_text(*rng))
+                if symbol:
+                    symbol.pin_table = get_pin_table(symbol.pins)
+                    symbol_cache.put(key, symbol)
+        return symbol
+
+    def is_stale(self):
+        '''Return True if the library file has changed since it was indexed.'''
+        try:
+            return get_file_stamp(self.lib_file) != self.stamp
+        except OSError:
+            return True
+
+
+# Regular expression for the lines that start and end symbols in a legacy library.
+lib_def_re = re.compile(br'^(DEF|ALIAS|ENDDEF)(?:[ \t]+([^\r\n]*))?', re.M)
+
+
+class SymbolLibrary(IndexedLibrary):
+    '''Byte-offset index of every symbol and alias in a legacy .lib library.'''
+
+    def build_index(self, data):
+        '''Find the byte range from the DEF to the ENDDEF of each symbol.'''
+        start = None
+        names = []
+        for mtch in lib_def_re.finditer(data):
+            keyword = mtch.group(1)
+            if keyword == b'DEF':
+                start = mtch.start()
+                names = (mtch.group(2) or b'').split()[:1]
+            elif keyword == b'ALIAS':
+                names.extend((mtch.group(2) or b'').split())
+            elif start is not None:
+                for name in names:
+                    self.add(name.decode('utf-8', 'replace'), (start, mtch.end()))
+                start = None
+
+    def add(self, name, offsets):
+        '''Index a symbol by its name. A leading ~ (hidden value) is ignored.'''
+        self.offsets[name] = offsets
+        self.offsets.setdefault(name.lstrip('~'), offsets)
+
+    def parse_symbol(self, text):
+        '''Return a symbol with the pins from the text of its DEF ... ENDDEF record.'''
+        symbol = Symbol()
+        symbol.pins = {}
+        symbol.units = set()
+        for line in text.splitlines():
+            if line.startswith('X '):
+                pin_info = line.split()
+                pin = Pin(pin_info[2], pin_info[1], pin_info[11], pin_info[9])
+                symbol.pins[pin.num] = pin
+                symbol.units.add(pin.unit)
+        return symbol
+
+
+# Codes used by legacy libraries for the electrical types in .kicad_sym libraries.
+KICAD_SYM_PIN_FUNCS = {
+    'input': 'I',
+    'output': 'O',
+    'bidirectional': 'B',
+    'tri_state': 'T',
+    'passive': 'P',
+    'free': 'U',  # Legacy libraries have no free pins, so treat them as unspecified.
+    'unspecified': 'U',
+    'power_in': 'W',
+    'power_out': 'w',
+    'open_collector': 'C',
+    'open_emitter': 'E',
+    'no_connect': 'N',
+}
+
+# Regular expression for the start of a symbol (or one of its units) in a .kicad_sym library.
+kicad_sym_re = re.compile(br'\(\s*symbol\s+(?:"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+# Regular expression for the unit and body style suffix of a unit's name.
+kicad_sym_unit_re = re.compile(r'_(\d+)_(\d+)$')
+
+
+class KicadSymbolLibrary(IndexedLibrary):
+    '''Byte-offset index of the symbols in a KiCad 6+ .kicad_sym library.'''
+
+    def build_index(self, data):
+        '''Find the byte range of each top-level symbol by searching for the start of each symbol.'''
+
+        # The units of a symbol are nested inside it and named after it with
+        # a _<unit>_<style> suffix, so any other symbol starts a new top-level one.
+        starts = []
+        top_name = None
+        for mtch in kicad_sym_re.finditer(data):
+            name = (mtch.group(1) or mtch.group(2)).decode('utf-8', 'replace')
+            if top_name is not None and name.startswith(top_name) and \
+                    kicad_sym_unit_re.match(name[len(top_name):]):
+                continue
+            top_name = name
+            starts.append((name, mtch.start()))
+        for i, (name, start) in enumerate(starts):
+            end = starts[i + 1][1] if i + 1 < len(starts) else len(data)
+            self.add(name, (start, end))
+
+    def add(self, name, offsets):
+        '''Index a symbol's byte range by its name, with and without any library prefix.'''
+        self.offsets[name] = offsets
+        self.offsets.setdefault(name.split(':')[-1], offsets)
+
+    def parse_symbol(self, text, depth=0):
+        '''Return a symbol with the pins from the text of its S-expression.'''
+
+        tokens = tokenize_sexp(io.StringIO(text))
+        if next(tokens, None) is not SEXP_OPEN:
+            return None
+        sexp = read_sexp(tokens)
+
+        symbol = Symbol()
+        symbol.pins = {}
+        symbol.units = set()
+
+        # A derived symbol gets its pins from the symbol it extends.
+        parent = sexp_value(sexp, 'extends')
+        if parent is not None and parent in self.offsets and depth < 10:
+            parent_symbol = self.parse_symbol(
+                self.read_text(*self.offsets[parent]), depth + 1)
+            if parent_symbol:
+                symbol.pins = parent_symbol.pins
+                symbol.units = parent_symbol.units
+
+        # Get the pins of the symbol and each of its units. Unit 0 holds the
+        # pins that are common to all units.
+        units = [('0', sexp)]
+        for item in sexp:
+            if isinstance(item, list) and len(item) > 1 and item[0] == 'symbol':
+                mtch = kicad_sym_unit_re.search(item[1])
+                units.append((mtch.group(1) if mtch else '0', item))
+        for unit, unit_sexp in units:
+            for item in unit_sexp:
+                if not (isinstance(item, list) and len(item) > 1 and item[0] == 'pin'):
+                    continue
+                num = sexp_value(item, 'number')
+                if num is None:
+                    continue
+                pin = Pin(num, sexp_value(item, 'name') or '',
+                          KICAD_SYM_PIN_FUNCS.get(item[1], 'U'), unit)
+                symbol.pins[pin.num] = pin
+                symbol.units.add(pin.unit)
+
+        return symbol
+
+
+# Symbol libraries that have already been indexed, indexed by file path.
+sym_libraries = {}
+
+
+def get_symbol_library(lib_file):
+    '''Return the index for a library file, rebuilding it if the file has changed.'''
+    lib_file = os.path.abspath(lib_file)
+    sym_lib = sym_libraries.get(lib_file)
+    if sym_lib is None or sym_lib.is_stale():
+        if lib_file.endswith('.kicad_sym'):
+            sym_lib = KicadSymbolLibrary(lib_file)
+        else:
+            sym_lib = SymbolLibrary(lib_file)
+        sym_libraries[lib_file] = sym_lib
+    return sym_lib
+
+
+def fillin_part_info_from_lib(ref, parts, warn=debug_dialog):
     '''Fill-in part information from its associated library file.'''
 
     try:
         part = parts[ref]
     except Exception:
-        debug_dialog(ref + ' was not found in the netlist!')
+        warn(ref + ' was not found in the netlist!')
         raise Exception(ref + ' was not found in the netlist!')
 
     part.pins = {}  # Store part's pin information here.
     part.units = set()  # Store list of part's units here.
+    part.pin_table = PinTable(part.pins)  # Store columns of pin information here.
 
     # Abort with empty pins and units if the part's library file was not found.
     if not part.lib_file:
-        debug_dialog('Part {} uses library {} that is not in the sym-lib-table file'.format(part.ref, part.lib))
+        warn('Part {} uses library {} that is not in the sym-lib-table file or whose file is missing'.format(part.ref, part.lib))
         return
 
-    # Find the part in the library and get the info for each pin.
-    with open(part.lib_file, 'r') as fp:
-        part_found = False
-        for line in fp:
-            if part_found:
-                if line.startswith('ENDDEF'):
-                    # Found the end of the desired part def, so we're done.
+    # Look up the part in the library index. Parts using the same symbol share
+    # the same pin information.
+    sym_lib = get_symbol_library(part.lib_file)
+    part.lib_stamp = sym_lib.stamp
+    symbol = sym_lib.get_symbol(part.part)
+    if symbol:
+        part.pins = symbol.pins
+        part.units = symbol.units
+        part.pin_table = symbol.pin_table
+
+
+class PinCache(object):
+    '''Pins of the parts on a PCB stored in a sidecar file so their libraries don't have to be read again.
+
+    The pins come from the netlist and the symbol libraries, so the cache is
+    tied to the hash of the netlist and emptied as soon as the netlist changes.
+    Each symbol also records the stamp of its library file so an edited
+    library isn't used either.
+    '''
+
+    version = 1  # Bump this whenever the format of the cached data changes.
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()  # Held by part loaders while using the cache.
+        self.netlist_hash = None
+        self.refs = {}  # Symbol key of each part indexed by reference.
+        self.symbols = {}  # Library file, stamp and pins of each symbol indexed by key.
+        self.loaded = {}  # Symbols rebuilt from the cache, indexed by key.
+        try:
+            with open(cache_file, 'r') as fp:
+                data = json.load(fp)
+            if data.get('version') == self.version:
+                self.netlist_hash = data['netlist_hash']
+                self.refs = data['refs']
+                self.symbols = data['symbols']
+        except (IOError, OSError, ValueError, KeyError):
+            # No usable sidecar file, so start with an empty cache.
+            pass
+
+    def save(self):
+        '''Write the cached pins to the sidecar file.'''
+        try:
+            write_json_file(self.cache_file, {
+                'version': self.version,
+                'netlist_hash': self.netlist_hash,
+                'refs': self.refs,
+                'symbols': self.symbols,
+            })
+        except (IOError, OSError):
+            # The cache is only an optimization, so ignore unwritable directories.
+            pass
+
+    def check_netlist(self, netlist_hash):
+        '''Empty the cache if its pins came from a different netlist.'''
+        if self.netlist_hash == netlist_hash:
+            return
+        if self.netlist_hash is not None:
+            stats.count('pin cache stale netlist')
+        self.netlist_hash = netlist_hash
+        self.refs = {}
+        self.symbols = {}
+        self.loaded = {}
+
+    def get_part(self, part):
+        '''Fill-in the pins of a part from the cache, returning False if they aren't cached or are out of date.'''
+
+        key = '{}:{}'.format(part.lib, part.part)
+        data = self.symbols.get(key)
+        if self.refs.get(part.ref) != key or data is None or data['lib_file'] != part.lib_file:
+            stats.count('pin cache miss')
+            return False
+        try:
+            stamp = get_file_stamp(part.lib_file)
+        except (OSError, TypeError):
+            stamp = None
+        if stamp != data['stamp']:
+            stats.count('pin cache miss')
+            return False
+
+        # Parts using the same symbol share the same pin information.
+        symbol = self.loaded.get(key)
+        if symbol is None:
+            symbol = Symbol()
+            symbol.pins = {num: Pin(num, name, func, unit)
+                           for num, name, func, unit in data['pins']}
+            symbol.units = set(pin.unit for pin in symbol.pins.values())
+            symbol.pin_table = get_pin_table(symbol.pins)
+            self.loaded[key] = symbol
+        part.pins = symbol.pins
+        part.units = symbol.units
+        part.pin_table = symbol.pin_table
+        part.lib_stamp = stamp
+        stats.count('pin cache hit')
+        return True
+
+    def put_part(self, part):
+        '''Store the pins of a part that was filled-in from its library.'''
+        if not part or not part.pins or getattr(part, 'lib_stamp', None) is None:
+            return
+        key = '{}:{}'.format(part.lib, part.part)
+        self.refs[part.ref] = key
+        data = self.symbols.get(key)
+        if data is None or data['stamp'] != part.lib_stamp or data['lib_file'] != part.lib_file:
+            self.symbols[key] = {
+                'lib_file': part.lib_file,
+                'stamp': part.lib_stamp,
+                'pins': [[pin.num, pin.name, pin.func, pin.unit] for pin in part.pins.values()],
+            }
+
+
+# Pin caches for each PCB, indexed by the path to their sidecar files.
+pin_caches = {}
+
+
+def get_pin_cache(brd_file):
+    '''Return the pin cache associated with a PCB file.'''
+    brd_dir = os.path.abspath(os.path.dirname(brd_file))
+    brd_name = os.path.splitext(os.path.basename(brd_file))[0]
+    cache_file = os.path.join(brd_dir, brd_name + '-padpainter.pins')
+    try:
+        return pin_caches[cache_file]
+    except KeyError:
+        # Part loaders can get here at the same time, so they must all end up with the same cache.
+        return pin_caches.setdefault(cache_file, PinCache(cache_file))
+
+
+def is_part_current(prev_part, part):
+    '''Return True if a previously-loaded part still matches the netlist and its library.'''
+    if prev_part is None or part is None or getattr(prev_part, 'lib_stamp', None) is None:
+        return False
+    if (prev_part.lib, prev_part.part, prev_part.lib_file) != (part.lib, part.part, part.lib_file):
+        return False
+    try:
+        return prev_part.lib_stamp == get_file_stamp(part.lib_file)
+    except OSError:
+        return False
+
+
+class PartLoader(threading.Thread):
+    '''Load the netlist and the symbol libraries of a set of parts in the background.
+
+    The loading is done in a worker thread so the GUI never blocks. Independent
+    library files are indexed in parallel by a pool of threads. Progress and
+    the final results are passed back to the GUI thread through wx.CallAfter.
+    Parts from a previous load that haven't changed are reused, and the pins
+    of other parts are taken from the PCB's pin cache if it's up to date, so
+    only new parts have to be looked up in their libraries. The references
+    can be patterns that are matched against the parts in the netlist.
+    '''
+
+    def __init__(self, netlist_file, brd_file, part_refs, on_progress, on_done,
+                 prev_parts=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.netlist_file = netlist_file
+        self.brd_file = brd_file
+        self.part_refs = part_refs
+        self.prev_parts = prev_parts or {}  # Parts that were already loaded.
+        self.on_progress = on_progress  # Called with (message, # done, # total).
+        self.on_done = on_done  # Called with (loader, parts, warnings).
+        self.cancelled = threading.Event()
+        self.net_index = None  # Connections between nets and pins once loaded.
+        self.ref_index = None  # References of the parts in the netlist once loaded.
+
+    def cancel(self):
+        '''Stop loading as soon as possible and discard the results.'''
+        self.cancelled.set()
+
+    def progress(self, msg, done, total):
+        if not self.cancelled.is_set():
+            wx.CallAfter(self.on_progress, msg, done, total)
+
+    def run(self):
+        warnings = []
+        parts = {}
+        try:
+            self.progress('Reading netlist...', 0, 1)
+            parts = get_parts_from_netlist(self.netlist_file, self.brd_file)
+            # The nets are only read if some criteria need them.
+            self.net_index = get_net_index(self.netlist_file, self.brd_file)
+            self.ref_index = RefIndex(parts)
+            self.part_refs = self.ref_index.expand(self.part_refs)
+
+            # Keep the parts that were already loaded and haven't changed, and
+            # get the pins of the others from the pin cache if they're there.
+            pin_cache = get_pin_cache(self.brd_file)
+            netlist_hash = get_netlist_cache(self.brd_file).get_entry(self.netlist_file)['hash']
+            new_refs = []
+            with pin_cache.lock:
+                pin_cache.check_netlist(netlist_hash)
+                for ref in self.part_refs:
+                    part = parts.get(ref)
+                    if is_part_current(self.prev_parts.get(ref), part):
+                        parts[ref] = self.prev_parts[ref]
+                    elif not (part and pin_cache.get_part(part)):
+                        new_refs.append(ref)
+
+            # Index each library file used by the new parts in parallel.
+            lib_files = set(
+                parts[ref].lib_file for ref in new_refs
+                if parts.get(ref) and parts[ref].lib_file)
+            with ThreadPoolExecutor(max_workers=max(1, min(len(lib_files), 4))) as pool:
+                futures = [pool.submit(get_symbol_library, f) for f in lib_files]
+                for done, future in enumerate(as_completed(futures), 1):
+                    if self.cancelled.is_set():
+                        for f in futures:
+                            f.cancel()
+                        return
+                    try:
+                        future.result()
+                    except (IOError, OSError) as e:
+                        warnings.append(str(e))
+                    self.progress('Reading libraries...', done, len(lib_files))
+
+            # The libraries are indexed, so filling-in the parts is quick.
+            for ref in new_refs:
+                if self.cancelled.is_set():
+                    return
+                try:
+                    fillin_part_info_from_lib(ref, parts, warn=warnings.append)
+                except Exception:
+                    pass
+
+            # Store the pins of the new parts for the next time.
+            if new_refs:
+                with pin_cache.lock:
+                    for ref in new_refs:
+                        pin_cache.put_part(parts.get(ref))
+                    pin_cache.save()
+        except Exception as e:
+            warnings.append('Something went wrong while loading parts!\n' + str(e))
+
+        if not self.cancelled.is_set():
+            wx.CallAfter(self.on_done, self, parts, warnings)
+
+
+class PadFilter(object):
+    '''Pad selection criteria compiled into sets and regular expressions.'''
+
+    def __init__(self, part_refs, units, num_re, name_re, pin_funcs, pin_states,
+                 net_re='', net_peers=(), min_fanout=0, region=None, near_refs=(),
+                 near_dist=0, nearest=0, rings=None):
+        # Keep the order of the part references but drop any duplicates.
+        self.part_refs = list(dict.fromkeys(part_refs))
+        # Units qualified with a part reference (e.g., 'U3:2') only apply to
+        # that part. The others apply to every part without qualified units.
+        self.units = set()
+        self.ref_units = {}
+        for unit in units:
+            ref, _, ref_unit = unit.rpartition(':')
+            if ref:
+                self.ref_units.setdefault(ref, set()).add(ref_unit)
+            else:
+                self.units.add(unit)
+        self.num_re = re.compile(num_re)
+        self.name_re = re.compile(name_re)
+        self.pin_funcs = set(pin_funcs)
+        self.pin_states = set(pin_states)
+        self.matches = {}  # Matching pin numbers indexed by the ids of the pin table and units.
+
+        # Criteria for the nets attached to the pins. These are ignored if empty.
+        self.net_re = re.compile(net_re) if net_re else None
+        self.net_peers = list(net_peers)  # Pins must share a net with these parts.
+        self.min_fanout = min_fanout  # Pins must be on nets with at least this many pins.
+        self.uses_nets = bool(self.net_re or self.net_peers or self.min_fanout > 0)
+        self.net_matches = {}  # Matching net names of each net index, indexed by id.
+
+        # Criteria for the positions of the pads, in millimeters. These are ignored if empty.
+        self.region = region  # Pads must be inside this (x0, y0, x1, y1) rectangle.
+        self.near_refs = list(near_refs)  # Pads must be close to the pads of these parts...
+        self.near_dist = near_dist  # ...either within this distance...
+        self.nearest = nearest  # ...or among this many of the closest pads.
+        self.rings = rings  # Pads must be in these rings of their footprint (0 is the outermost).
+        self.uses_space = bool(region or (self.near_refs and (near_dist > 0 or nearest > 0)) or rings)
+
+    def match_pins(self, pin_table, ref=None):
+        '''Return the set of pin numbers in a pin table that meet all the criteria except pin state.'''
+
+        # Parts using the same symbol and units share a pin table, so only evaluate it once.
+        units = self.ref_units.get(ref, self.units)
+        key = (id(pin_table), id(units))
+        try:
+            return self.matches[key][1]
+        except KeyError:
+            pass
+
+        # Pick the rows in the selected units and functions from the groups
+        # of the pin table before running the regular expressions on them.
+        pin_funcs = self.pin_funcs
+        num_search, name_search = self.num_re.search, self.name_re.search
+        nums, names = pin_table.nums, pin_table.names
+        matched = frozenset(
+            nums[row]
+            for (unit, func), rows in pin_table.groups.items()
+            if unit in units and func in pin_funcs
+            for row in rows
+            if num_search(nums[row]) and name_search(names[row])
+        )
+
+        # Keep a reference to the pin table so its id can't be reused.
+        self.matches[key] = (pin_table, matched)
+        return matched
+
+    def match_nets(self, net_index):
+        '''Return the set of net names in a net index that meet the net criteria.'''
+
+        try:
+            return self.net_matches[id(net_index)][1]
+        except KeyError:
+            pass
+
+        if self.net_peers:
+            # Only the nets attached to the peer parts are candidates.
+            nets = set()
+            for ref in self.net_peers:
+                nets |= net_index.ref_nets.get(ref, set())
+        else:
+            nets = net_index.nodes.keys()
+        if self.net_re:
+            net_search = self.net_re.search
+            nets = [net for net in nets if net_search(net)]
+        if self.min_fanout > 0:
+            nets = [net for net in nets if net_index.fanout(net) >= self.min_fanout]
+        matched = frozenset(nets)
+
+        # Keep a reference to the net index so its id can't be reused.
+        self.net_matches[id(net_index)] = (net_index, matched)
+        return matched
+
+    def match_space(self, board_index):
+        '''Return the ids of the pads of the parts that meet the region, distance and ring criteria.
+
+        The nearest-pads criterion depends on the other criteria, so it's
+        applied afterwards by nearest_pads().
+        '''
+
+        allowed = None
+        if self.rings:
+            allowed = set()
+            for ref in self.part_refs:
+                entry = board_index.get_geometry(ref)
+                if entry is None:
+                    continue
+                for (_, _, pad), ring in zip(entry.pads, entry.rings):
+                    if ring in self.rings:
+                        allowed.add(id(pad))
+
+        if self.region or (self.near_refs and self.near_dist > 0):
+            grid = board_index.get_pad_grid()
+            if self.region:
+                in_region = set(id(pad) for _, _, pad in grid.in_rect(*self.region))
+                allowed = in_region if allowed is None else allowed & in_region
+            if self.near_refs and self.near_dist > 0:
+                # Only the pads inside the bounding box of the near pads grown by
+                # the distance have to be checked against the near pads.
+                near_pads = PointSweep(board_index.get_pad_positions(self.near_refs))
+                near = set()
+                if near_pads.xs:
+                    dist = self.near_dist
+                    ys = [y for _, y in near_pads.points]
+                    for x, y, pad in grid.in_rect(near_pads.xs[0] - dist, min(ys) - dist,
+                                                  near_pads.xs[-1] + dist, max(ys) + dist):
+                        if near_pads.distance2(x, y, dist * dist) is not None:
+                            near.add(id(pad))
+                allowed = near if allowed is None else allowed & near
+        return allowed
+
+    def nearest_pads(self, board_index, pads):
+        '''Return the ids of the pads that are among the closest to the pads of the near parts.'''
+
+        candidates = set(id(pad) for pad in pads)
+        near_pads = PointSweep(board_index.get_pad_positions(self.near_refs))
+        if not near_pads.xs or len(candidates) <= self.nearest:
+            return candidates
+
+        # Rank the candidates by the distance to their closest near pad.
+        positions = board_index.get_pad_grid().positions
+        distances = []
+        for key in candidates:
+            x, y = positions[key]
+            distances.append((near_pads.distance2(x, y), key))
+        return set(key for _, key in heapq.nsmallest(self.nearest, distances))
+
+    def match_state(self, connected):
+        '''Return True if the connection state of a pin meets the criteria.'''
+        if connected:
+            return 'C' in self.pin_states
+        return 'U' in self.pin_states
+
+
+def get_footprints(board):
+    '''Return the footprints on a board for both older and newer versions of KiCad.'''
+    try:
+        return board.GetFootprints()
+    except AttributeError:
+        return board.GetModules()
+
+
+def get_item_id(item):
+    '''Return an identifier for the KiCad object wrapped by a SWIG proxy.'''
+    try:
+        return int(item.this)
+    except (AttributeError, TypeError):
+        return id(item)
+
+
+def get_placement(footprint):
+    '''Return the position, orientation and layer of a footprint for detecting when it moves.'''
+    pos = footprint.GetPosition()
+    try:
+        angle = footprint.GetOrientationDegrees()
+    except AttributeError:
+        angle = footprint.GetOrientation() / 10.0  # KiCad 5 uses tenths of a degree.
+    return (pos.x, pos.y, angle, footprint.GetLayer())
+
+
+def get_pad_rings(positions, placement):
+    '''Return the ring of each pad in a footprint, counting inward from 0 for its outermost rows and columns.'''
+
+    # Undo the rotation of the footprint so its rows and columns of pads are
+    # lined up with the axes, then number the distinct row and column positions.
+    ox, oy = placement[0] / IU_PER_MM, placement[1] / IU_PER_MM
+    angle = math.radians(placement[2])
+    c, s = math.cos(angle), math.sin(angle)
+    local = [(round((x - ox) * c - (y - oy) * s, 2), round((x - ox) * s + (y - oy) * c, 2))
+             for x, y in positions]
+    cols = {x: i for i, x in enumerate(sorted(set(x for x, _ in local)))}
+    rows = {y: i for i, y in enumerate(sorted(set(y for _, y in local)))}
+    return [min(cols[x], len(cols) - 1 - cols[x], rows[y], len(rows) - 1 - rows[y])
+            for x, y in local]
+
+
+class FootprintEntry(object):
+    '''Snapshot of a footprint and the name, net name and object of each of its pads.
+
+    The positions of the pads are only read when they're first needed and
+    again whenever the footprint moves.
+    '''
+
+    def __init__(self, footprint, footprint_id, pad_count):
+        self.footprint = footprint
+        self.footprint_id = footprint_id
+        self.pad_count = pad_count
+        self.pads = [(pad.GetName(), pad.GetNetname(), pad)
+                     for pad in footprint.Pads()]
+        self.net_codes = get_net_codes(self.pads)
+        self.nets_checked = True  # False once the nets may have changed since they were read.
+        self.placement = None
+        self.positions = []  # (x, y) of each pad in millimeters.
+        self.rings = []  # Ring of each pad in the footprint.
+
+    def update_geometry(self):
+        '''Re-read the positions of the pads if the footprint has moved, returning True if it had.'''
+        placement = get_placement(self.footprint)
+        if placement == self.placement:
+            return False
+        self.placement = placement
+        self.positions = []
+        for _, _, pad in self.pads:
+            pos = pad.GetPosition()
+            self.positions.append((pos.x / IU_PER_MM, pos.y / IU_PER_MM))
+        self.rings = get_pad_rings(self.positions, placement)
+        return True
+
+    def refresh_nets(self, net_codes=None):
+        '''Re-read the net names of the pads.'''
+        self.pads = [(name, pad.GetNetname(), pad) for name, _, pad in self.pads]
+        self.net_codes = net_codes if net_codes is not None else get_net_codes(self.pads)
+
+
+def get_net_codes(pads):
+    '''Return the net code of each (name, net name, pad) so changes to the nets of a footprint can be found.'''
+    return tuple(pad.GetNetCode() for _, _, pad in pads)
+
+
+class PadGrid(object):
+    '''Pads sorted into the cells of a uniform grid so those in a region are found without a scan.
+
+    The cells are sized to hold a few pads each on average, so a query only
+    looks at the pads in the cells that overlap its region.
+    '''
+
+    def __init__(self, items):
+        # Each item is the (x, y, pad) of a pad with its position in millimeters.
+        if items:
+            x0 = min(x for x, _, _ in items)
+            x1 = max(x for x, _, _ in items)
+            y0 = min(y for _, y, _ in items)
+            y1 = max(y for _, y, _ in items)
+        else:
+            x0 = x1 = y0 = y1 = 0.0
+        area = max((x1 - x0) * (y1 - y0), 1.0)
+        self.cell_size = max(math.sqrt(4 * area / max(len(items), 1)), 0.1)
+        self.cells = {}  # Items in each cell indexed by (column, row).
+        self.positions = {}  # Position of each pad indexed by its id.
+        for item in items:
+            self.positions[id(item[2])] = item[:2]
+            key = (int(math.floor(item[0] / self.cell_size)), int(math.floor(item[1] / self.cell_size)))
+            self.cells.setdefault(key, []).append(item)
+
+    def in_rect(self, x0, y0, x1, y1):
+        '''Generate the items inside a rectangle.'''
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        c0, c1 = int(math.floor(x0 / self.cell_size)), int(math.floor(x1 / self.cell_size))
+        r0, r1 = int(math.floor(y0 / self.cell_size)), int(math.floor(y1 / self.cell_size))
+
+        # Visit the cells overlapping the rectangle, or just the occupied
+        # cells if there are fewer of those.
+        if (c1 - c0 + 1) * (r1 - r0 + 1) <= len(self.cells):
+            cells = (self.cells.get((c, r), ()) for c in range(c0, c1 + 1) for r in range(r0, r1 + 1))
+        else:
+            cells = (items for (c, r), items in self.cells.items()
+                     if c0 <= c <= c1 and r0 <= r <= r1)
+        for items in cells:
+            for item in items:
+                if x0 <= item[0] <= x1 and y0 <= item[1] <= y1:
+                    yield item
+
+
+class PointSweep(object):
+    '''Points sorted by X so the closest one to a location is found by sweeping outward from it.'''
+
+    def __init__(self, points):
+        self.points = sorted(points)
+        self.xs = [x for x, _ in self.points]
+
+    def distance2(self, x, y, limit2=float('inf')):
+        '''Return the squared distance to the closest point, or None if none are within the limit.'''
+
+        # Sweep left and right from the location, stopping in each direction
+        # once the points are further away in X alone than the closest so far.
+        best = None
+        bound = limit2
+        points, xs = self.points, self.xs
+        start = bisect_left(xs, x)
+        for indices in (range(start, len(xs)), range(start - 1, -1, -1)):
+            for i in indices:
+                dx2 = (xs[i] - x) ** 2
+                if dx2 > bound:
                     break
+                d2 = dx2 + (points[i][1] - y) ** 2
+                if d2 <= bound:
+                    best = bound = d2
+        return best
+
+
+class BoardIndex(object):
+    '''Snapshot of the footprints and pads on a board indexed by part reference.
+
+    Building the snapshot crosses the SWIG boundary once for every pad on the
+    board. After that, refresh() only makes a few calls per footprint to find
+    the footprints that were added, replaced or had their pads changed. The
+    nets of a footprint's pads are only checked for changes when they're used.
+    '''
+
+    def __init__(self, board):
+        self.board = board
+        self.footprints = {}  # Footprint entries indexed by part reference.
+        self.grid = None  # Grid of pad positions, built when it's first needed.
+        self.refresh()
+
+    def refresh(self):
+        '''Update the snapshot for footprints whose pads or nets have changed.'''
+        with stats.timer('board snapshot'):
+            self._refresh()
+
+    def _refresh(self):
+        footprints = {}
+        for footprint in get_footprints(self.board):
+            ref = footprint.GetReference()
+            footprint_id = get_item_id(footprint)
+            pad_count = footprint.GetPadCount()
+            entry = self.footprints.get(ref)
+            if (entry is None or entry.footprint_id != footprint_id
+                    or entry.pad_count != pad_count):
+                entry = FootprintEntry(footprint, footprint_id, pad_count)
+                self.grid = None
+            else:
+                # Checking the nets takes a call for every pad, so it's put off
+                # until the pads of the footprint are actually used.
+                entry.nets_checked = False
+            footprints[ref] = entry
+        if len(footprints) != len(self.footprints):
+            self.grid = None
+        self.footprints = footprints
+
+    def invalidate(self):
+        '''Force the snapshot to be rebuilt completely on the next refresh.'''
+        self.footprints = {}
+        self.grid = None
+
+    def get_pad_grid(self):
+        '''Return a grid of the positions of all the pads, rebuilding it if any footprint has moved.'''
+        with stats.timer('pad grid'):
+            for ref in self.footprints:
+                self.get_geometry(ref)
+            if self.grid is None:
+                self.grid = PadGrid([
+                    (x, y, pad)
+                    for entry in self.footprints.values()
+                    for (x, y), (_, _, pad) in zip(entry.positions, entry.pads)
+                ])
+        return self.grid
+
+    def get_entry(self, ref):
+        '''Return the footprint entry of a part with the nets of its pads up-to-date, or None.
+
+        The net names are only re-read if the pads were moved to other nets
+        (e.g., by importing a netlist or editing a single pad), which the net
+        count of the board can miss.
+        '''
+        entry = self.footprints.get(ref)
+        if entry is not None and not entry.nets_checked:
+            net_codes = get_net_codes(entry.pads)
+            if net_codes != entry.net_codes:
+                entry.refresh_nets(net_codes)
+            entry.nets_checked = True
+        return entry
+
+    def get_geometry(self, ref):
+        '''Return the footprint entry of a part with the positions of its pads up-to-date, or None.
+
+        Every caller must come through here rather than updating an entry
+        itself, so the grid is dropped whenever any footprint is seen to move.
+        '''
+        entry = self.footprints.get(ref)
+        if entry is not None and entry.update_geometry():
+            self.grid = None
+        return entry
+
+    def get_pad_positions(self, refs):
+        '''Return the positions of the pads of some parts in millimeters.'''
+        positions = []
+        for ref in refs:
+            entry = self.get_geometry(ref)
+            if entry is not None:
+                positions.extend(entry.positions)
+        return positions
+
+    def get_nets(self):
+        '''Return a dict of the (reference, pad name) nodes attached to each net on the board.'''
+        nets = {}
+        for ref in self.footprints:
+            for pad_name, net_name, _ in self.get_entry(ref).pads:
+                if net_name.strip():
+                    nets.setdefault(net_name, []).append((ref, pad_name))
+        return nets
+
+
+def get_parts_from_board(board_index, part_refs, warn=debug_dialog):
+    '''Get the pins of parts from the pads of their footprints when there's no netlist.
+
+    Since KiCad 6, each pad stores the name and electrical type of the symbol
+    pin it's attached to. Pads don't store the unit of their pin, so all the
+    pins of a part are put in BOARD_UNIT. This calls into PCBNEW, so it must
+    run in the GUI thread.
+    '''
+
+    parts = {}
+    for ref in part_refs:
+        entry = board_index.footprints.get(ref)
+        if entry is None:
+            warn(ref + ' was not found on the board!')
+            continue
+        part = Part()
+        part.ref = ref
+        part.lib = part.part = part.lib_file = None
+        part.pins = {}
+        try:
+            for pad_name, _, pad in entry.pads:
+                # Pin types of unconnected pins end with '+no_connect'.
+                pin_type = pad.GetPinType().split('+')[0]
+                if pad_name and pin_type:
+                    part.pins[pad_name] = Pin(pad_name, pad.GetPinFunction(),
+                                              KICAD_SYM_PIN_FUNCS.get(pin_type, 'U'),
+                                              BOARD_UNIT)
+        except AttributeError:
+            warn('The pads on this board have no pin information, so a netlist is needed.')
+            return parts
+        part.units = set(pin.unit for pin in part.pins.values())
+        part.pin_table = get_pin_table(part.pins)
+        parts[ref] = part
+    return parts
 
-                if line.startswith('X '):
-                    # Read pin information records once the desired part def is found.
-                    pin_info = line.split()
-                    pin = Pin()
-                    pin.num = pin_info[2]
-                    pin.name = pin_info[1]
-                    pin.func = pin_info[11]
-                    pin.unit = pin_info[9]
-                    part.pins[pin.num] = pin
-                    part.units.add(pin.unit)
 
+def iter_selected_pads(board_index, parts, pad_filter, net_index=None):
+    '''Generate the (reference, pin, net name, pad) of each PCB pad that meets the criteria of a pad filter.
+
+    If a net index from the netlist is given and the criteria involve the nets,
+    those are taken from it. Otherwise, they come from the board so the
+    netlist's nets never have to be read. The connection state of a pin always
+    comes from its pad on the board.
+    '''
+
+    if not pad_filter.uses_nets:
+        net_index = None
+
+    # Get the nets that meet the net criteria, using the nets on the board
+    # if there's no netlist.
+    allowed_nets = None
+    if pad_filter.uses_nets:
+        allowed_nets = pad_filter.match_nets(
+            net_index or NetIndex(board_index.get_nets()))
+
+    # Get the pads that meet the position criteria.
+    allowed_pads = None
+    if pad_filter.uses_space:
+        allowed_pads = pad_filter.match_space(board_index)
+
+    # The nearest pads can only be picked once all the other criteria have
+    # been applied, so those pads are collected first.
+    if pad_filter.near_refs and pad_filter.nearest > 0:
+        selected = list(iter_matching_pads(board_index, parts, pad_filter, net_index,
+                                           allowed_nets, allowed_pads))
+        nearest = pad_filter.nearest_pads(board_index, [pad for _, _, _, pad in selected])
+        for item in selected:
+            if id(item[3]) in nearest:
+                yield item
+    else:
+        for item in iter_matching_pads(board_index, parts, pad_filter, net_index,
+                                       allowed_nets, allowed_pads):
+            yield item
+
+
+def iter_matching_pads(board_index, parts, pad_filter, net_index, allowed_nets, allowed_pads):
+    '''Generate the pads that meet the pin criteria of a filter and are in the allowed nets and pads.'''
+
+    # Don't bother checking the pad's net if every state is accepted.
+    check_state = len(pad_filter.pin_states) < 2
+
+    for ref in pad_filter.part_refs:
+        # Only visit the footprints of the parts named in the filter.
+        entry = board_index.get_entry(ref)
+        part = parts.get(ref)
+        pin_table = getattr(part, 'pin_table', None)
+        if entry is None or pin_table is None:
+            continue
+        matched = pad_filter.match_pins(pin_table, ref)
+        if not matched:
+            continue
+        for pad_name, net_name, pad in entry.pads:
+            # Pads that aren't associated with a pin in the electrical symbol
+            # (e.g., mounting holes) are never matched.
+            if pad_name not in matched:
+                continue
+            # Older netlists put each unconnected pin on a net of its own, so
+            # whether a pin is connected is decided by its pad, as it always was.
+            connected = net_name.strip() != ''
+            if net_index is not None:
+                net_name = net_index.pin_nets.get((ref, pad_name), '')
+            if check_state and not pad_filter.match_state(connected):
+                continue
+            if allowed_nets is not None and net_name not in allowed_nets:
+                continue
+            if allowed_pads is not None and id(pad) not in allowed_pads:
                 continue
+            yield ref, part.pins[pad_name], net_name, pad
 
-            # Look for the start of the desired part's definition.
-            part_found = (re.search(r'^DEF\s+' + part.part + r'\s+', line) or
-                re.search(r'^ALIAS\s+([^\s]+\s+)*' + part.part + r'\s+', line))
+
+def select_pads(board_index, parts, pad_filter, net_index=None):
+    '''Return a list of PCB pads that meet the criteria of a pad filter.'''
+    with stats.timer('filter'):
+        return [pad for _, _, _, pad in
+                iter_selected_pads(board_index, parts, pad_filter, net_index)]
+
+
+def update_preview(previewed, selected_pads):
+    '''Change the brightened pads of a live preview to match a new selection.
+
+    previewed is a dict of the pads brightened by the preview indexed by id.
+    Only pads whose state changes are touched: pads that dropped out of the
+    selection are cleared and newly selected pads are brightened. Pads that
+    were already brightened by something else are left alone so the preview
+    never erases paint it didn't apply. Returns the new dict of previewed pads
+    and whether any pad changed.
+    '''
+
+    selected = {id(pad): pad for pad in selected_pads}
+    changed = False
+
+    for key, pad in previewed.items():
+        if key not in selected:
+            pad.ClearBrightened()
+            changed = True
+
+    new_previewed = {}
+    for key, pad in selected.items():
+        if key in previewed:
+            new_previewed[key] = pad
+        elif not pad.IsBrightened():
+            pad.SetBrightened()
+            new_previewed[key] = pad
+            changed = True
+
+    return new_previewed, changed
+
+
+def paint_pads(pads, brighten=True):
+    '''Brighten or clear a batch of pads, returning the number of pads whose state changed.
+
+    Each pad is touched once even if it was selected several times, and pads
+    that are already in the wanted state are skipped, so the board only has to
+    be redrawn if something actually changed.
+    '''
+    changed = 0
+    done = set()
+    for pad in pads:
+        key = id(pad)
+        if key in done:
+            continue
+        done.add(key)
+        if pad.IsBrightened() != brighten:
+            if brighten:
+                pad.SetBrightened()
+            else:
+                pad.ClearBrightened()
+            changed += 1
+    return changed
+
+
+class BoardSession(object):
+    '''State of the GUI for a board that's kept after PadPainter is closed.
+
+    Only plain Python data is kept. The pads and footprints of the board are
+    KiCad objects that may be deleted once PadPainter closes, so the board is
+    snapshotted again each time PadPainter is opened.
+    '''
+
+    def __init__(self, brd_file):
+        self.brd_file = brd_file
+        self.netlist_file = None  # Netlist used the last time.
+        self.parts = {}  # Parts loaded from the netlist and libraries.
+        self.net_index = None  # Connections between nets and pins from the netlist.
+        self.criteria = None  # Criteria in the GUI when it was closed.
+        self.layers = set()  # Names of the profiles that were painted.
+
+
+# Sessions for every board PadPainter has been used on, indexed by PCB file.
+# The netlists, library indexes and symbols they use are kept in the caches
+# above, so they're shared by all the boards and reused when PadPainter reopens.
+board_sessions = {}
+
+
+def get_board_session(brd_file):
+    '''Return the session for a PCB file, creating it if PadPainter hasn't been used on it yet.'''
+    try:
+        return board_sessions[brd_file]
+    except KeyError:
+        session = BoardSession(brd_file)
+        board_sessions[brd_file] = session
+        return session
 
 
 def get_project_directory():
@@ -259,17 +2160,502 @@ def get_project_directory():
     return os.path.dirname(GetBoard().GetFileName())
 
 
-def guess_netlist_file():
+def guess_netlist_file(brd_file=None):
     '''Try to find the netlist file for this PCB.'''
 
-    design_name = os.path.splitext(os.path.abspath(
-        GetBoard().GetFileName()))[0]
+    if brd_file is None:
+        brd_file = GetBoard().GetFileName()
+    design_name = os.path.splitext(os.path.abspath(brd_file))[0]
     netlist_file_name = design_name + '.net'
     if os.path.isfile(netlist_file_name):
         return netlist_file_name
     return ''
 
 
+def split_list(value):
+    '''Return a list of items from a comma-separated string or any other iterable.'''
+    if isinstance(value, str):
+        value = value.split(',')
+    return [str(v).strip() for v in value if str(v).strip()]
+
+
+def split_region(value):
+    '''Return the (x0, y0, x1, y1) corners of a region given as a comma-separated string or list, or None if it's empty.'''
+    corners = [float(v) for v in split_list(value or [])]
+    if not corners:
+        return None
+    if len(corners) != 4:
+        raise ValueError('A region needs four coordinates: x0,y0,x1,y1')
+    return tuple(corners)
+
+
+def split_rings(value):
+    '''Return the set of ring numbers given as a list or a string like "0-1,3", or None if it's empty.'''
+    rings = set()
+    for item in split_list(value or []):
+        first, _, last = str(item).partition('-')
+        rings.update(range(int(first), int(last or first) + 1))
+    return rings or None
+
+
+def make_pad_filter(rule, parts, ref_index=None):
+    '''Return a pad filter for a rule given as a dict of criteria.
+
+    The rule holds the same criteria as the GUI fields. Any missing criteria
+    select everything: all units of the parts, every pin function and state.
+    Pin functions and states can be given as labels (e.g., 'I/O') or codes (e.g., 'B').
+    Part references can be patterns that are matched against the reference index.
+    Regions and distances are in millimeters.
+    '''
+
+    part_refs = get_rule_refs(rule, parts, ref_index)
+    units = rule.get('units')
+    if units is None:
+        units = set()
+        for ref in part_refs:
+            units |= getattr(parts.get(ref), 'units', set())
+    funcs = [PIN_FUNCS.get(f, f) for f in split_list(rule.get('funcs', PIN_FUNCS.values()))]
+    states = [PIN_STATES.get(s, s) for s in split_list(rule.get('states', PIN_STATES.values()))]
+    near_refs = split_list(rule.get('near', []))
+    if near_refs:
+        near_refs = (ref_index or RefIndex(parts)).expand(near_refs)
+    return PadFilter(part_refs, split_list(units), rule.get('nums', '.*'),
+                     rule.get('names', '.*'), funcs, states, rule.get('nets', ''),
+                     split_list(rule.get('net_peers', [])), int(rule.get('min_fanout', 0)),
+                     split_region(rule.get('region')), near_refs,
+                     float(rule.get('near_dist', 0)), int(rule.get('nearest', 0)),
+                     split_rings(rule.get('rings')))
+
+
+def fillin_rule_parts(rule, parts, warn=debug_dialog, ref_index=None, board_index=None):
+    '''Fill-in the library information for the parts of a rule that haven't been loaded yet.
+
+    If a board index is given because there's no netlist, the pins are taken
+    from the pads of the board instead of the libraries.
+    '''
+    if board_index is not None:
+        refs = [ref for ref in get_rule_refs(rule, parts, ref_index) if ref not in parts]
+        parts.update(get_parts_from_board(board_index, refs, warn))
+        return
+    for ref in get_rule_refs(rule, parts, ref_index):
+        if not parts.get(ref):
+            warn(ref + ' was not found in the netlist!')
+        elif getattr(parts[ref], 'pin_table', None) is None:
+            fillin_part_info_from_lib(ref, parts, warn=warn)
+
+
+class PaintProfiles(object):
+    '''Named selection criteria saved in a file next to the PCB, along with the pads they select.
+
+    Each profile holds a rule with the same criteria as the GUI fields. The
+    (reference, pad name) pairs it selected are stored with the netlist hash
+    and a hash of the footprints they depend on, so the profile can be painted
+    again without filtering until the netlist or those footprints change.
+    '''
+
+    version = 1  # Bump this whenever the format of the stored profiles changes.
+
+    def __init__(self, profiles_file):
+        self.profiles_file = profiles_file
+        self.profiles = {}  # Criteria, pads and their source indexed by profile name.
+        try:
+            with open(profiles_file, 'r') as fp:
+                data = json.load(fp)
+            if data.get('version') == self.version:
+                self.profiles = data['profiles']
+        except (IOError, OSError, ValueError, KeyError):
+            # No usable profiles file, so start without any profiles.
+            pass
+
+    def save(self):
+        '''Write the profiles to their file.'''
+        try:
+            write_json_file(self.profiles_file, {'version': self.version, 'profiles': self.profiles},
+                            indent=1)
+        except (IOError, OSError) as e:
+            debug_dialog('Unable to save the profiles to ' + self.profiles_file, e)
+
+    def names(self):
+        '''Return the sorted names of the profiles.'''
+        return sorted(self.profiles)
+
+    def rules(self):
+        '''Return the criteria of every profile as named rules for evaluate_board() and exports.'''
+        rules = []
+        for name in self.names():
+            rule = self.get_criteria(name)
+            rule['name'] = name
+            rules.append(rule)
+        return rules
+
+    def get_criteria(self, name):
+        '''Return a copy of the criteria stored in a profile.'''
+        return dict(self.profiles[name]['criteria'])
+
+    def set_criteria(self, name, criteria):
+        '''Create or replace a profile, discarding any pads it selected before.'''
+        self.profiles[name] = {'criteria': dict(criteria), 'source': None, 'pads': []}
+
+    def get_pads(self, name, source):
+        '''Return the (reference, pad name) pairs selected by a profile, or None if the source has changed.'''
+        profile = self.profiles.get(name)
+        if profile is None or profile['source'] != source:
+            return None
+        return [tuple(key) for key in profile['pads']]
+
+    def set_pads(self, name, source, pad_keys):
+        '''Store the (reference, pad name) pairs selected by a profile from the given source.'''
+        self.profiles[name]['source'] = source
+        self.profiles[name]['pads'] = [list(key) for key in pad_keys]
+
+    def delete(self, name):
+        '''Remove a profile.'''
+        self.profiles.pop(name, None)
+
+
+def get_paint_profiles(brd_file):
+    '''Return the paint profiles saved with a PCB file.'''
+    brd_dir = os.path.abspath(os.path.dirname(brd_file))
+    brd_name = os.path.splitext(os.path.basename(brd_file))[0]
+    return PaintProfiles(os.path.join(brd_dir, brd_name + '-padpainter.profiles'))
+
+
+def get_board_state(board_index, criteria, all_nets=False):
+    '''Return a hash of the placements and pad nets of the footprints that the pads of a profile depend on.
+
+    These are the footprints of the profile's parts, the parts their pads must
+    be near and the parts they must share nets with. If all_nets is True, the
+    nets of every footprint are used (e.g., to count the pins on each net).
+    The footprints are read from the board as it is now, so moving parts or
+    changing nets is seen before the PCB file is saved.
+    '''
+    if all_nets:
+        refs = list(board_index.footprints)
+    else:
+        ref_index = RefIndex(board_index.footprints)
+        refs = set(ref_index.expand(split_list(criteria.get('parts', []))))
+        refs.update(ref_index.expand(split_list(criteria.get('near', []))))
+        refs.update(split_list(criteria.get('net_peers', [])))
+    hasher = hashlib.sha1()
+    for ref in sorted(refs):
+        entry = board_index.get_geometry(ref)
+        if entry is not None:
+            board_index.get_entry(ref)
+            state = (ref, entry.placement, [(name, net) for name, net, _ in entry.pads])
+        else:
+            state = (ref, None)
+        hasher.update(repr(state).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def get_profile_source(netlist_file, brd_file, board_index, criteria):
+    '''Return what the pads of a profile depend on: the hash of the netlist and the state of the board.
+
+    Without a netlist, the pins and nets come from the board, so the counts of
+    pins on its nets depend on every footprint.
+    '''
+    netlist_hash = None
+    if netlist_file:
+        netlist_hash = get_netlist_cache(brd_file).get_entry(netlist_file)['hash']
+    all_nets = netlist_hash is None and int(criteria.get('min_fanout', 0)) > 0
+    return [netlist_hash, get_board_state(board_index, criteria, all_nets)]
+
+
+def find_pads(board_index, pad_keys):
+    '''Return the PCB pads with the given (reference, pad name) pairs, or None if any are missing.'''
+
+    pad_names = {}
+    for ref, pad_name in pad_keys:
+        pad_names.setdefault(ref, set()).add(pad_name)
+
+    pads = []
+    for ref, names in pad_names.items():
+        entry = board_index.footprints.get(ref)
+        if entry is None:
+            return None
+        found = set()
+        for pad_name, _, pad in entry.pads:
+            if pad_name in names:
+                found.add(pad_name)
+                pads.append(pad)
+        if found != names:
+            return None
+    return pads
+
+
+def find_profile_pads(profiles, name, board_index, source):
+    '''Return the PCB pads stored with a profile, or None if they're out of date with the source.'''
+    pad_keys = profiles.get_pads(name, source)
+    if pad_keys is not None:
+        pads = find_pads(board_index, pad_keys)
+        if pads is not None:
+            stats.count('profile pads hit')
+            return pads
+    stats.count('profile pads miss')
+    return None
+
+
+def get_profile_pads(profiles, name, board_index, parts, net_index, source, warn=debug_dialog,
+                     ref_index=None):
+    '''Return the PCB pads selected by a profile, only filtering them again if the source has changed.
+
+    Without a net index from a netlist, the pins are taken from the pads of the board.
+    '''
+
+    pads = find_profile_pads(profiles, name, board_index, source)
+    if pads is not None:
+        return pads
+
+    # The stored pads are out of date, so apply the criteria again and store the result.
+    criteria = profiles.get_criteria(name)
+    fillin_rule_parts(criteria, parts, warn, ref_index, board_index if net_index is None else None)
+    with stats.timer('filter'):
+        selected = list(iter_selected_pads(board_index, parts,
+                                           make_pad_filter(criteria, parts, ref_index), net_index))
+    profiles.set_pads(name, source, sorted(set((ref, pin.num) for ref, pin, _, _ in selected)))
+    profiles.save()
+    return [pad for _, _, _, pad in selected]
+
+
+# Columns of the pin reports, in order.
+REPORT_FIELDS = ['board', 'rule', 'ref', 'pad', 'name', 'func', 'unit', 'net', 'x', 'y']
+
+
+def iter_pad_rows(brd_file, rule_name, board_index, parts, pad_filter, net_index=None):
+    '''Generate a pin report row for each PCB pad that meets the criteria of a pad filter.
+
+    Each row is a dict with the board, rule name, part reference, pad number,
+    pin name, function and unit, the net, and the pad position in millimeters.
+    '''
+    positions = {}  # Positions of the pads of the current footprint indexed by pad id.
+    positions_ref = None
+    for ref, pin, net_name, pad in iter_selected_pads(board_index, parts, pad_filter, net_index):
+        # The pads come grouped by part, so only look up the positions when the part changes.
+        if ref != positions_ref:
+            entry = board_index.get_geometry(ref)
+            positions = dict(zip((id(p) for _, _, p in entry.pads), entry.positions))
+            positions_ref = ref
+        x, y = positions[id(pad)]
+        yield {
+            'board': brd_file,
+            'rule': rule_name,
+            'ref': ref,
+            'pad': pin.num,
+            'name': pin.name,
+            'func': pin.func,
+            'unit': pin.unit,
+            'net': net_name,
+            'x': x,
+            'y': y,
+        }
+
+
+def iter_rule_rows(brd_file, rules, board_index, parts, net_index=None, ref_index=None, warn=debug_dialog):
+    '''Generate the pin report rows for the pads that meet each rule.
+
+    The library information of the parts in each rule is filled-in as the rule
+    is reached. Without a net index from a netlist, the pins are taken from the
+    pads on the board instead.
+    '''
+    for i, rule in enumerate(rules):
+        fillin_rule_parts(rule, parts, warn, ref_index, board_index if net_index is None else None)
+        pad_filter = make_pad_filter(rule, parts, ref_index)
+        for row in iter_pad_rows(brd_file, rule.get('name', str(i + 1)), board_index,
+                                 parts, pad_filter, net_index):
+            yield row
+
+
+def write_pad_rows(rows, out, fmt='csv'):
+    '''Write pin report rows to a file as CSV or JSON as they're generated, returning the number of rows.'''
+
+    count = 0
+    with stats.timer('export'):
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(REPORT_FIELDS)
+            for count, row in enumerate(rows, 1):
+                writer.writerow([row[field] for field in REPORT_FIELDS])
+        else:
+            # Write a JSON list one row at a time rather than dumping it all at once.
+            out.write('[')
+            for count, row in enumerate(rows, 1):
+                out.write(',\n' if count > 1 else '\n')
+                out.write(json.dumps(row))
+            out.write('\n]\n')
+    return count
+
+
+def evaluate_board(brd_file, rules, netlist_file=None):
+    '''Generate the pin report rows of the pads that meet each rule for a PCB file loaded without the GUI.
+
+    If rules is None, the paint profiles saved with the board are used as the rules.
+    '''
+
+    def warn(msg):
+        sys.stderr.write('{}: {}\n'.format(brd_file, msg))
+
+    netlist_file = netlist_file or guess_netlist_file(brd_file)
+    board_index = BoardIndex(LoadBoard(brd_file))
+    if netlist_file:
+        parts = get_parts_from_netlist(netlist_file, brd_file)
+        net_index = get_net_index(netlist_file, brd_file)
+        ref_index = RefIndex(parts)
+    else:
+        # Without a netlist, get the pins from the pads and the nets from the board.
+        warn('No netlist was found, so the pin information on the board is used.')
+        parts = {}
+        net_index = None
+        ref_index = RefIndex(board_index.footprints)
+    if rules is None:
+        rules = get_paint_profiles(brd_file).rules()
+
+    for row in iter_rule_rows(brd_file, rules, board_index, parts, net_index, ref_index, warn):
+        yield row
+
+
+def _evaluate_board_job(job):
+    '''Evaluate one board in a worker process, returning the rows or an error message.
+
+    The rows have to be collected into a list to pass them back from the worker.
+    '''
+    brd_file, rules, netlist_file = job
+    try:
+        return list(evaluate_board(brd_file, rules, netlist_file)), None
+    except Exception as e:
+        return [], '{}: {}'.format(brd_file, e)
+
+
+def _iter_job_rows(jobs, pool, errors):
+    '''Generate the rows of each board job, reporting and counting the boards that fail.
+
+    Without a pool of workers, the rows of each board are streamed as they're
+    found. Otherwise, each worker returns the rows of a whole board.
+    '''
+    if pool:
+        for rows, error in pool.imap(_evaluate_board_job, jobs):
+            if error:
+                sys.stderr.write(error + '\n')
+                errors.append(error)
+            for row in rows:
+                yield row
+        return
+
+    for job in jobs:
+        try:
+            for row in evaluate_board(*job):
+                yield row
+        except Exception as e:
+            sys.stderr.write('{}: {}\n'.format(job[0], e))
+            errors.append(job[0])
+
+
+def main(argv=None):
+    '''Select pads on one or more boards from the command line and output them as CSV or JSON.'''
+
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(
+        description='Output the pads on KiCad PCBs that meet a set of conditions.')
+    parser.add_argument('boards', nargs='+', help='PCB files to process.')
+    parser.add_argument('--netlist', help='Netlist file (only with a single board). '
+                        'Defaults to the PCB file name with a .net extension.')
+    parser.add_argument('--rules', help='JSON file with a list of rules, each a dict '
+                        'with the same keys as the criteria options below plus a name.')
+    parser.add_argument('--profiles', action='store_true', help='Use the paint profiles '
+                        'saved with each board as the rules.')
+    parser.add_argument('--parts', default='', help='Comma-separated part references '
+                        '(required unless --rules or --profiles is given).')
+    parser.add_argument('--units', help='Comma-separated part units (default: all).')
+    parser.add_argument('--nums', default='.*', help='Regular expression for pin numbers.')
+    parser.add_argument('--names', default='.*', help='Regular expression for pin names.')
+    parser.add_argument('--funcs', help='Comma-separated pin functions as labels or codes, '
+                        'e.g. "I/O,In" or "B,I" (default: all).')
+    parser.add_argument('--states', help='Comma-separated pin states: Connected, Unconnected (default: both).')
+    parser.add_argument('--nets', default='', help='Regular expression for net names.')
+    parser.add_argument('--net-peers', default='', help='Comma-separated part references that pins must share a net with.')
+    parser.add_argument('--min-fanout', type=int, default=0, help='Minimum number of pins on a net.')
+    parser.add_argument('--region', default='', help='Comma-separated corners x0,y0,x1,y1 (mm) of a region pads must be in.')
+    parser.add_argument('--near', default='', help='Comma-separated part references that pads must be close to.')
+    parser.add_argument('--near-dist', type=float, default=0, help='Maximum distance (mm) of pads from the --near parts.')
+    parser.add_argument('--nearest', type=int, default=0, help='Number of pads closest to the --near parts to keep.')
+    parser.add_argument('--rings', default='', help='Rings of pads counted in from the edge of their footprint, e.g. "0-1".')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv', help='Output format.')
+    parser.add_argument('--output', help='Output file (default: standard output).')
+    parser.add_argument('--jobs', type=int, default=0,
+                        help='Number of boards to process in parallel (default: number of CPUs).')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print the time taken by each stage and the cache counters.')
+    parser.add_argument('--profile', help='Save a cProfile of the run to this file.')
+    args = parser.parse_args(argv)
+
+    # Timings and profiles are collected in this process, so don't use workers.
+    if args.stats or args.profile:
+        args.jobs = 1
+        stats.reset()
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if args.netlist and len(args.boards) > 1:
+        parser.error('--netlist can only be used with a single board.')
+    # An empty rule selects nothing, which would look like a clean result.
+    if not (args.parts or args.rules or args.profiles):
+        parser.error('--parts is required unless --rules or --profiles is given.')
+
+    # Get the rules from the file or build a single rule from the options.
+    # Saved profiles are read from each board by evaluate_board().
+    if args.profiles:
+        rules = None
+    elif args.rules:
+        with open(args.rules, 'r') as fp:
+            rules = json.load(fp)
+    else:
+        rule = {
+            'name': 'cmdline',
+            'parts': args.parts,
+            'nums': args.nums,
+            'names': args.names,
+            'nets': args.nets,
+            'net_peers': args.net_peers,
+            'min_fanout': args.min_fanout,
+            'region': args.region,
+            'near': args.near,
+            'near_dist': args.near_dist,
+            'nearest': args.nearest,
+            'rings': args.rings,
+        }
+        for key in ('units', 'funcs', 'states'):
+            if getattr(args, key) is not None:
+                rule[key] = getattr(args, key)
+        rules = [rule]
+
+    # Evaluate the boards, spreading them over multiple processes, and
+    # write the rows out as they arrive.
+    jobs = [(brd_file, rules, args.netlist) for brd_file in args.boards]
+    num_procs = min(args.jobs or multiprocessing.cpu_count(), len(jobs))
+    pool = multiprocessing.Pool(num_procs) if num_procs > 1 else None
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    errors = []
+    try:
+        write_pad_rows(_iter_job_rows(jobs, pool, errors), out, args.format)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if out is not sys.stdout:
+            out.close()
+
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if args.stats:
+        sys.stderr.write(stats.report() + '\n')
+
+    return 1 if errors else 0
+
+
 class menuSelection(wx.Menu):
     '''Menu of the distributor checkbox list. Provide select all, unselect and toggle hotkey.'''
     def __init__( self, parent ):
@@ -316,6 +2702,9 @@ class PadPainterFrame(wx.Frame):
         # Main panel holding all the widgets.
         panel = wx.Panel(parent=self)
 
+        # Get what was loaded the last time PadPainter was used on this board.
+        self.session = get_board_session(GetBoard().GetFileName())
+
         # File browser widget for getting netlist file for this layout.
         netlist_file_wildcard = 'Netlist File|*.net|All Files|*.*'
         self.netlist_file_picker = DnDFilePickerCtrl(
@@ -326,34 +2715,57 @@ class PadPainterFrame(wx.Frame):
             'Drag-and-drop netlist file associated with this layout or browse for file or enter file name.',
             dialogTitle='Select netlist file associated with this layout',
             startDirectory=get_project_directory(),
-            initialValue=guess_netlist_file(),
+            initialValue=self.session.netlist_file or guess_netlist_file(),
             fileMask=netlist_file_wildcard,
             fileMode=wx.FD_OPEN)
         self.Bind(wx.EVT_FILEPICKER_CHANGED, self.UpdateUnits,
                   self.netlist_file_picker)
 
+        # Progress of loading the netlist and libraries in the background.
+        self.loader = None
+        self.load_status = wx.StaticText(panel, label='')
+        self.load_gauge = wx.Gauge(panel, range=1)
+        self.cancel_btn = wx.Button(panel, -1, 'Cancel')
+        self.cancel_btn.SetToolTip(
+            wx.ToolTip('Click to stop loading the netlist and libraries.'))
+        self.cancel_btn.Disable()
+        self.Bind(wx.EVT_BUTTON, self.OnCancelLoad, self.cancel_btn)
+        load_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        load_sizer.AddSpacer(WIDGET_SPACING)
+        load_sizer.Add(self.load_gauge, 1, wx.ALL | wx.ALIGN_CENTER)
+        load_sizer.AddSpacer(WIDGET_SPACING)
+        load_sizer.Add(self.load_status, 1, wx.ALL | wx.ALIGN_CENTER)
+        load_sizer.AddSpacer(WIDGET_SPACING)
+        load_sizer.Add(self.cancel_btn, 0, wx.ALL | wx.ALIGN_CENTER)
+        load_sizer.AddSpacer(WIDGET_SPACING)
+
+        # Take a snapshot of the footprints and pads on the board so they
+        # don't have to be fetched from PCBNEW every time pads are selected.
+        self.board_index = BoardIndex(GetBoard())
+
         # Widget for specifying which parts to paint. It starts off preloaded
         # with any parts that have already been selected in the PCBNEW layout.
         selected_parts = ','.join([
-            p.GetReference() for p in GetBoard().GetModules()
-            if p.IsSelected()
+            ref for ref, entry in self.board_index.footprints.items()
+            if entry.footprint.IsSelected()
         ])
         self.part_refs = LabelledTextCtrl(
             parent=panel,
             label='Parts:',
             value=selected_parts,
             tooltip=
-            "Enter a single part reference or multiple, comma-separated references to paint. Then press 'ENTER'."
+            "Enter a single part reference or multiple, comma-separated references to paint. Then press 'ENTER'.\n"
+            "References can have wildcards (e.g., J*) or be regular expressions (e.g., U[0-9]+)."
         )
         self.Bind(wx.EVT_TEXT_ENTER, self.UpdateUnits, self.part_refs.ctrl)
 
         # Widget for specifying the units in the parts that will be painted.
-        self.units = LabelledListBox(
+        self.units = LabelledUnitList(
             parent=panel,
             label='Units:',
-            choices=[],
             tooltip=
-            "Select one or more units in the part to paint.\n(Use shift-click and ctrl-click to select multiple units.)"
+            "Select one or more units in the part to paint.\n(Use shift-click and ctrl-click to select multiple units.)\n"
+            "Units are prefixed with their part reference when the parts use different symbols."
         )
 
         # Widget for specifying the pin numbers in the parts that will be painted.
@@ -370,20 +2782,52 @@ class PadPainterFrame(wx.Frame):
             value='.*',
             tooltip="Enter regular expression to select pin names to paint.")
 
+        # Widgets for specifying the nets of the pins that will be painted.
+        self.nets = LabelledTextCtrl(
+            parent=panel,
+            label='Net Names:',
+            value='',
+            tooltip="Enter regular expression to select pins on matching nets to paint.\n(Leave blank to ignore net names.)")
+        self.net_peers = LabelledTextCtrl(
+            parent=panel,
+            label='Shares Net With:',
+            value='',
+            tooltip="Enter one or more comma-separated part references to only paint pins sharing a net with them.")
+        self.min_fanout = LabelledTextCtrl(
+            parent=panel,
+            label='Min Net Fanout:',
+            value='0',
+            tooltip="Enter the minimum number of pins on a net for its pins to be painted.")
+
+        # Widgets for specifying where the pads that will be painted are on the PCB.
+        self.region = LabelledTextCtrl(
+            parent=panel,
+            label='Region (mm):',
+            value='',
+            tooltip="Enter the corners x0,y0,x1,y1 of a rectangle to only paint pads inside it.\n(Leave blank to ignore pad positions.)")
+        self.near_refs = LabelledTextCtrl(
+            parent=panel,
+            label='Near Parts:',
+            value='',
+            tooltip="Enter one or more comma-separated part references to only paint pads close to their pads.")
+        self.near_dist = LabelledTextCtrl(
+            parent=panel,
+            label='Within (mm):',
+            value='0',
+            tooltip="Enter the maximum distance of painted pads from the pads of the near parts.\n(Zero ignores the distance.)")
+        self.nearest = LabelledTextCtrl(
+            parent=panel,
+            label='Nearest Pads:',
+            value='0',
+            tooltip="Enter how many of the pads closest to the near parts to paint.\n(Zero paints all of them.)")
+        self.rings = LabelledTextCtrl(
+            parent=panel,
+            label='Pad Rings:',
+            value='',
+            tooltip="Enter the rings of pads to paint counting in from the edge of each footprint, e.g. 0-1 for the two outer rings of a BGA.\n(Leave blank to paint every ring.)")
+
         # Checkboxes for selecting which functional types of pins will be painted.
-        self.pin_func_btn_lbls = {
-            'In': 'I',
-            'Out': 'O',
-            'I/O': 'B',
-            'Pwr In': 'W',
-            'Pwr Out': 'w',
-            'Passive': 'P',
-            '3-State': 'T',
-            'OpenColl': 'C',
-            'OpenEmit': 'E',
-            'Unspec': 'U',
-            'NC': 'N',
-        }
+        self.pin_func_btn_lbls = PIN_FUNCS
         pin_func_sizer = wx.StaticBoxSizer(wx.StaticBox(panel, wx.ID_ANY, u"Pin Functions:"), wx.VERTICAL)
         self.pin_func_list = wx.CheckListBox(panel, wx.ID_ANY, wx.DefaultPosition, wx.DefaultSize, sorted(list(self.pin_func_btn_lbls)), 0)
         self.pin_func_list.SetToolTip(wx.ToolTip(u"Check/uncheck to enable/disable painting of all functional pin types.\nRight-click to select/unselect/toggle all." ))
@@ -392,12 +2836,37 @@ class PadPainterFrame(wx.Frame):
         self.pin_func_list.Bind(wx.EVT_RIGHT_DOWN, self.pin_func_list_rClick)
         pin_func_sizer.Add(self.pin_func_list, 0, wx.ALL, 5 )
 
+        # List of saved profiles. Selecting a profile loads its criteria and
+        # checking it paints its pads, so several profiles can be shown at once.
+        self.profiles = get_paint_profiles(GetBoard().GetFileName())
+        self.layers = {}  # Pads painted by each checked profile, indexed by name.
+        self.layer_loaders = {}  # (Loader, paint flag) of profiles whose parts are loading, indexed by name.
+        self.export_loader = None  # Loader of the parts of the pads being exported.
+        self.pending_units = None  # Units to select once a profile's parts are loaded.
+        profile_sizer = wx.StaticBoxSizer(wx.StaticBox(panel, wx.ID_ANY, u"Profiles:"), wx.VERTICAL)
+        self.profile_list = wx.CheckListBox(panel, wx.ID_ANY, wx.DefaultPosition, wx.DefaultSize, self.profiles.names(), 0)
+        self.profile_list.SetToolTip(wx.ToolTip(
+            u"Select a profile to load its criteria.\nCheck/uncheck a profile to paint/clear its pads."))
+        self.Bind(wx.EVT_LISTBOX, self.OnSelectProfile, self.profile_list)
+        self.Bind(wx.EVT_CHECKLISTBOX, self.OnProfileLayer, self.profile_list)
+        self.save_profile_btn = wx.Button(panel, -1, 'Save')
+        self.save_profile_btn.SetToolTip(
+            wx.ToolTip('Click to save the current criteria as a named profile.'))
+        self.delete_profile_btn = wx.Button(panel, -1, 'Delete')
+        self.delete_profile_btn.SetToolTip(
+            wx.ToolTip('Click to delete the selected profile.'))
+        self.Bind(wx.EVT_BUTTON, self.OnSaveProfile, self.save_profile_btn)
+        self.Bind(wx.EVT_BUTTON, self.OnDeleteProfile, self.delete_profile_btn)
+        profile_btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        profile_btn_sizer.Add(self.save_profile_btn, flag=wx.ALL | wx.ALIGN_CENTER)
+        profile_btn_sizer.AddSpacer(WIDGET_SPACING)
+        profile_btn_sizer.Add(self.delete_profile_btn, flag=wx.ALL | wx.ALIGN_CENTER)
+        profile_sizer.Add(self.profile_list, 1, wx.ALL | wx.EXPAND, 5)
+        profile_sizer.Add(profile_btn_sizer, 0, wx.ALL | wx.ALIGN_CENTER, 5)
+
 
         # Checkboxes for selecting the state of the pins.
-        self.pin_state_btn_lbls = {
-            'Connected': 'C',
-            'Unconnected': 'U',
-        }
+        self.pin_state_btn_lbls = PIN_STATES
         self.pin_state_btns = {
             lbl: wx.CheckBox(panel, label=lbl)
             for lbl in self.pin_state_btn_lbls
@@ -416,13 +2885,48 @@ class PadPainterFrame(wx.Frame):
         self.clear_btn = wx.Button(panel, -1, 'Clear')
         self.clear_btn.SetToolTip(
             wx.ToolTip('Click to erase paint from selected pads on the PCB.'))
+        self.export_btn = wx.Button(panel, -1, 'Export')
+        self.export_btn.SetToolTip(
+            wx.ToolTip('Click to save the pins of the selected pads or of every profile to a CSV or JSON file.'))
         self.done_btn = wx.Button(panel, -1, 'Done')
         self.done_btn.SetToolTip(
             wx.ToolTip('Click when finished. Any painted pads will remain.'))
         self.Bind(wx.EVT_BUTTON, self.OnPaint, self.paint_btn)
         self.Bind(wx.EVT_BUTTON, self.OnClear, self.clear_btn)
+        self.Bind(wx.EVT_BUTTON, self.OnExport, self.export_btn)
         self.Bind(wx.EVT_BUTTON, self.OnDone, self.done_btn)
 
+        # Checkbox for highlighting the selected pads as the criteria are edited.
+        self.preview_btn = wx.CheckBox(panel, label='Live Preview')
+        self.preview_btn.SetValue(False)
+        self.preview_btn.SetToolTip(wx.ToolTip(
+            'Check to highlight the selected pads while editing the criteria. '
+            'Press Paint to keep the highlighting.'))
+        self.Bind(wx.EVT_CHECKBOX, self.OnLivePreview, self.preview_btn)
+        self.parts = self.session.parts  # Part information from the netlist and libraries.
+        self.ref_index = None  # Sorted part references for matching patterns.
+        self.net_index = self.session.net_index  # Connections between nets and pins from the netlist.
+        self.previewed = {}  # Pads brightened by the live preview, indexed by id.
+        self.preview_timer = None
+
+        # Update the live preview whenever any of the criteria change.
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.nums.ctrl)
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.names.ctrl)
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.nets.ctrl)
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.net_peers.ctrl)
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.min_fanout.ctrl)
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.region.ctrl)
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.near_refs.ctrl)
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.near_dist.ctrl)
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.nearest.ctrl)
+        self.Bind(wx.EVT_TEXT, self.SchedulePreview, self.rings.ctrl)
+        self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.SchedulePreview, self.units.lbx)
+        self.Bind(wx.EVT_LIST_ITEM_DESELECTED, self.SchedulePreview, self.units.lbx)
+        self.Bind(wx.EVT_CHECKLISTBOX, self.SchedulePreview, self.pin_func_list)
+        for btn in self.pin_state_btns.values():
+            self.Bind(wx.EVT_CHECKBOX, self.SchedulePreview, btn)
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
+
         # Create a horizontal sizer for holding all the pin-state checkboxes.
         pin_state_sizer = wx.BoxSizer(wx.HORIZONTAL)
         pin_state_sizer.AddSpacer(WIDGET_SPACING)
@@ -436,6 +2940,8 @@ class PadPainterFrame(wx.Frame):
         pin_state_sizer.Add(
             self.pin_state_btns['Unconnected'], flag=wx.ALL | wx.ALIGN_CENTER)
         pin_state_sizer.AddSpacer(WIDGET_SPACING)
+        pin_state_sizer.Add(self.preview_btn, flag=wx.ALL | wx.ALIGN_CENTER)
+        pin_state_sizer.AddSpacer(WIDGET_SPACING)
 
         # Create a horizontal sizer for holding the action buttons.
         btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
@@ -444,6 +2950,8 @@ class PadPainterFrame(wx.Frame):
         btn_sizer.AddSpacer(WIDGET_SPACING)
         btn_sizer.Add(self.clear_btn, flag=wx.ALL | wx.ALIGN_CENTER)
         btn_sizer.AddSpacer(WIDGET_SPACING)
+        btn_sizer.Add(self.export_btn, flag=wx.ALL | wx.ALIGN_CENTER)
+        btn_sizer.AddSpacer(WIDGET_SPACING)
         btn_sizer.Add(self.done_btn, flag=wx.ALL | wx.ALIGN_CENTER)
         btn_sizer.AddSpacer(WIDGET_SPACING)
 
@@ -453,19 +2961,59 @@ class PadPainterFrame(wx.Frame):
         sizer.Add(self.units, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
         sizer.Add(self.nums, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
         sizer.Add(self.names, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        sizer.Add(self.nets, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        sizer.Add(self.net_peers, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        sizer.Add(self.min_fanout, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        sizer.Add(self.region, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        sizer.Add(self.near_refs, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        sizer.Add(self.near_dist, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        sizer.Add(self.nearest, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        sizer.Add(self.rings, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
         sizer.Add(pin_state_sizer, 0, wx.ALL, WIDGET_SPACING)
         sizer.Add(btn_sizer, 0, wx.ALL | wx.ALIGN_CENTER, WIDGET_SPACING)
 
+        # Collapsible panel showing how long each stage of the operations took.
+        self.stats_pane = wx.CollapsiblePane(panel, label='Statistics')
+        self.Bind(wx.EVT_COLLAPSIBLEPANE_CHANGED, self.OnStatsPane, self.stats_pane)
+        stats_panel = self.stats_pane.GetPane()
+        self.stats_text = wx.StaticText(stats_panel, label=stats.report())
+        self.stats_text.SetFont(wx.Font(wx.FontInfo(8).Family(wx.FONTFAMILY_TELETYPE)))
+        self.reset_stats_btn = wx.Button(stats_panel, -1, 'Reset')
+        self.reset_stats_btn.SetToolTip(
+            wx.ToolTip('Click to reset the timings and counters.'))
+        self.profile_btn = wx.ToggleButton(stats_panel, -1, 'Capture Profile')
+        self.profile_btn.SetToolTip(wx.ToolTip(
+            'Press to start profiling PadPainter. Release to save the profile to a file.'))
+        self.profiler = None
+        self.Bind(wx.EVT_BUTTON, self.OnResetStats, self.reset_stats_btn)
+        self.Bind(wx.EVT_TOGGLEBUTTON, self.OnCaptureProfile, self.profile_btn)
+        stats_btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        stats_btn_sizer.Add(self.reset_stats_btn, flag=wx.ALL | wx.ALIGN_CENTER)
+        stats_btn_sizer.AddSpacer(WIDGET_SPACING)
+        stats_btn_sizer.Add(self.profile_btn, flag=wx.ALL | wx.ALIGN_CENTER)
+        stats_sizer = wx.BoxSizer(wx.VERTICAL)
+        stats_sizer.Add(self.stats_text, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        stats_sizer.Add(stats_btn_sizer, 0, wx.ALL, WIDGET_SPACING)
+        stats_panel.SetSizer(stats_sizer)
+
+        # Create a vertical sizer for the pin types and the profiles.
+        side_sizer = wx.BoxSizer(wx.VERTICAL)
+        side_sizer.Add(pin_func_sizer, 0, wx.ALL | wx.EXPAND, 0)
+        side_sizer.AddSpacer(WIDGET_SPACING)
+        side_sizer.Add(profile_sizer, 1, wx.ALL | wx.EXPAND, 0)
+
         # Create a horizontal sizer to hold the vertical sizer above and the pin types.
         sizer0 = wx.BoxSizer(wx.HORIZONTAL)
         sizer0.Add(sizer, 0, wx.ALL | wx.ALIGN_CENTER, WIDGET_SPACING)
-        sizer0.Add(pin_func_sizer, 0, wx.ALL, WIDGET_SPACING)
+        sizer0.Add(side_sizer, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
 
         # Create the main vertical sizer.
         sizer00 = wx.BoxSizer(wx.VERTICAL)
         sizer00.Add(self.netlist_file_picker, 0, wx.ALL | wx.EXPAND,
                   WIDGET_SPACING)
+        sizer00.Add(load_sizer, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
         sizer00.Add(sizer0, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
+        sizer00.Add(self.stats_pane, 0, wx.ALL | wx.EXPAND, WIDGET_SPACING)
 
         # Size the panel.
         panel.SetSizer(sizer00)
@@ -475,109 +3023,611 @@ class PadPainterFrame(wx.Frame):
         # Finally, size the frame that holds the panel.
         self.Fit()
 
+        # Pick up where PadPainter left off the last time it was used on this
+        # board, unless some parts were selected in the layout.
+        if self.session.criteria and not selected_parts:
+            self.SetCriteria(self.session.criteria)
+        for name in self.session.layers:
+            if name in self.profiles.names():
+                self.PaintLayer(name, paint=False)
+        self.UpdateProfileList()
+
     def pin_func_list_rClick(self, event):
         ''' Open the context menu with distributors options.'''
         try:
             menu = menuSelection(self.pin_func_list)
             self.PopupMenu(menu, event.GetPosition())
             menu.Destroy()
+            self.SchedulePreview()
         except Exception as e:
             debug_dialog(str(e))
 
     def UpdateUnits(self, evt):
-        '''Update the list of part units from the selected parts.'''
+        '''Start loading the selected parts so the list of part units can be updated.'''
+
+        part_refs = split_list(self.part_refs.ctrl.GetValue())
+
+        # Abandon any previous load.
+        if self.loader:
+            self.loader.cancel()
+            self.loader = None
+
+        # Without a netlist, get the pins of the parts from the pads on the
+        # board. The netlist isn't touched at all in this mode.
+        netlist_file = self.GetNetlistFile()
+        if netlist_file is None:
+            self.board_index.refresh()
+            ref_index = RefIndex(self.board_index.footprints)
+            part_refs = ref_index.expand(part_refs)
+            parts = get_parts_from_board(self.board_index, part_refs)
+            self.session.netlist_file = None
+            self.ShowParts(part_refs, parts, None, ref_index)
+            return
 
-        self.parts = get_parts_from_netlist(self.netlist_file_picker.GetPath())
-        part_refs = [
-            p.strip() for p in self.part_refs.ctrl.GetValue().split(',') if p
-        ]
-        for ref in part_refs:
-            fillin_part_info_from_lib(ref, self.parts)
+        # Otherwise, load the netlist and libraries in the background.
+        self.loader = PartLoader(netlist_file,
+                                 GetBoard().GetFileName(), part_refs,
+                                 self.OnLoadProgress, self.OnLoadDone,
+                                 self.parts)
+        self.cancel_btn.Enable()
+        self.loader.start()
+
+    def OnLoadProgress(self, msg, done, total):
+        '''Show the progress of loading the netlist and libraries.'''
+        self.load_status.SetLabel(msg)
+        self.load_gauge.SetRange(max(total, 1))
+        self.load_gauge.SetValue(done)
+
+    def OnCancelLoad(self, evt):
+        '''Stop loading the netlist and libraries.'''
+        if self.loader:
+            self.loader.cancel()
+            self.loader = None
+        self.cancel_btn.Disable()
+        self.load_status.SetLabel('Cancelled.')
+        self.load_gauge.SetValue(0)
+
+    def OnLoadDone(self, loader, parts, warnings):
+        '''Update the list of part units once the selected parts are loaded.'''
+
+        # Ignore the results of loads that were superseded or cancelled.
+        if loader is not self.loader:
+            return
+        self.loader = None
+        self.cancel_btn.Disable()
+        self.load_status.SetLabel('')
+        self.load_gauge.SetValue(0)
+
+        for msg in warnings:
+            debug_dialog(msg)
+
+        self.session.netlist_file = loader.netlist_file
+        self.ShowParts(loader.part_refs, parts, loader.net_index, loader.ref_index)
+
+    def ShowParts(self, part_refs, parts, net_index, ref_index):
+        '''Use a new set of loaded parts and show their units.'''
+
+        self.parts = self.session.parts = parts
+        self.net_index = self.session.net_index = net_index
+        self.ref_index = ref_index
+
+        # Show the units if all the parts use the same symbol, which share a
+        # pin table. Otherwise, prefix each unit with its part reference (e.g., 'U3:2').
+        loaded = [self.parts[ref] for ref in part_refs if getattr(self.parts.get(ref), 'pins', None)]
+        if len(set(id(part.pin_table) for part in loaded)) <= 1:
+            units = set()
+            for part in loaded:
+                units |= part.units
+            units = sorted(units, key=natural_key)
+        else:
+            units = [
+                '{}:{}'.format(part.ref, unit)
+                for part in loaded for unit in sorted(part.units, key=natural_key)
+            ]
+        self.units.lbx.SetItems(units, self.pending_units)
+        self.pending_units = None
+
+        self.SchedulePreview()
+        self.UpdateStats()
+
+    def GetCriteria(self):
+        '''Return the selection criteria set in the GUI as a rule like those of the command line.'''
+        return {
+            'parts': self.part_refs.ctrl.GetValue(),
+            'units': self.units.lbx.GetSelectedItems(),
+            'nums': self.nums.ctrl.GetValue(),
+            'names': self.names.ctrl.GetValue(),
+            'funcs': [
+                self.pin_func_list.GetString(i)
+                for i in range(self.pin_func_list.GetCount())
+                    if self.pin_func_list.IsChecked(i)
+            ],
+            'states': [
+                btn.GetLabel()
+                for btn in self.pin_state_btns.values() if btn.GetValue()
+            ],
+            'nets': self.nets.ctrl.GetValue().strip(),
+            'net_peers': self.net_peers.ctrl.GetValue(),
+            'min_fanout': int(self.min_fanout.ctrl.GetValue().strip() or 0),
+            'region': self.region.ctrl.GetValue().strip(),
+            'near': self.near_refs.ctrl.GetValue(),
+            'near_dist': float(self.near_dist.ctrl.GetValue().strip() or 0),
+            'nearest': int(self.nearest.ctrl.GetValue().strip() or 0),
+            'rings': self.rings.ctrl.GetValue().strip(),
+        }
 
-        units = set()
-        for ref in part_refs:
-            units |= self.parts[ref].units
+    def SetCriteria(self, criteria):
+        '''Show the selection criteria of a rule in the GUI and load its parts.'''
+        self.part_refs.ctrl.ChangeValue(','.join(split_list(criteria.get('parts', []))))
+        self.nums.ctrl.ChangeValue(criteria.get('nums', '.*'))
+        self.names.ctrl.ChangeValue(criteria.get('names', '.*'))
+        self.nets.ctrl.ChangeValue(criteria.get('nets', ''))
+        self.net_peers.ctrl.ChangeValue(','.join(split_list(criteria.get('net_peers', []))))
+        self.min_fanout.ctrl.ChangeValue(str(criteria.get('min_fanout', 0)))
+        self.region.ctrl.ChangeValue(','.join(str(v) for v in split_list(criteria.get('region') or [])))
+        self.near_refs.ctrl.ChangeValue(','.join(split_list(criteria.get('near', []))))
+        self.near_dist.ctrl.ChangeValue(str(criteria.get('near_dist', 0)))
+        self.nearest.ctrl.ChangeValue(str(criteria.get('nearest', 0)))
+        self.rings.ctrl.ChangeValue(','.join(str(v) for v in split_list(criteria.get('rings') or [])))
+        funcs = criteria.get('funcs', list(self.pin_func_btn_lbls))
+        for i in range(self.pin_func_list.GetCount()):
+            self.pin_func_list.Check(i, self.pin_func_list.GetString(i) in funcs)
+        states = criteria.get('states', list(self.pin_state_btn_lbls))
+        for btn_lbl, btn in self.pin_state_btns.items():
+            btn.SetValue(btn_lbl in states)
+        self.pending_units = criteria.get('units')
+        self.UpdateUnits(None)
 
-        self.units.lbx.Clear()
-        self.units.lbx.InsertItems(list(units), 0)
-        for i in range(self.units.lbx.GetCount()):
-            self.units.lbx.SetSelection(i)
+    def GetPadFilter(self):
+        '''Return a pad filter for the selection criteria set in the GUI.'''
+        return make_pad_filter(self.GetCriteria(), self.parts, self.ref_index)
 
     def SelectPads(self):
         '''Return a list of PCB pads that meet the selection criteria set in the GUI.'''
 
-        # Get the criteria for selecting pads.
-        # Create a list of selected part units.
-        lbx = self.units.lbx
-        selected_units = [lbx.GetString(i) for i in lbx.GetSelections()]
-        # Get the regular expressions for selecting pad numbers and names.
-        num_re = self.nums.ctrl.GetValue()
-        name_re = self.names.ctrl.GetValue()
-        # Create a list of selected part references.
-        part_refs = [
-            p.strip() for p in self.part_refs.ctrl.GetValue().split(',') if p
-        ]
-        # Create a list of enabled pin functions.
-        selected_pin_funcs = [
-            self.pin_func_btn_lbls[self.pin_func_list.GetString(i)]
-            for i in range(self.pin_func_list.GetCount())
-                if self.pin_func_list.IsChecked(i)
-        ]
-        # Create a list of enabled pin states.
-        selected_pin_states = [
-            self.pin_state_btn_lbls[btn.GetLabel()]
-            for btn in self.pin_state_btns.values() if btn.GetValue()
-        ]
-
         # Go through the pads and select those that meet the criteria.
         selected_pads = []
         try:
-            for part in GetBoard().GetModules():
-                ref = part.GetReference()
-                if ref not in part_refs:
-                    continue
-                try:
-                    symbol = self.parts[ref]
-                except KeyError:
-                    continue
-                for pad in part.Pads():
-                    try:
-                        pin = symbol.pins[pad.GetName()]
-                        if pad.GetNet().GetNetname().strip() == '':
-                            pin.state = 'U'
-                        else:
-                            pin.state = 'C'
-                    except KeyError:
-                        # This usually happens when the footprint has a mounting
-                        # hole that's not associated with a pin in the electrical symbol.
-                        continue
-                    if (pin.unit in selected_units and re.search(num_re, pin.num)
-                            and re.search(name_re, pin.name)
-                            and pin.func in selected_pin_funcs
-                            and pin.state in selected_pin_states):
-                        selected_pads.append(pad)
+            pad_filter = self.GetPadFilter()
+            self.board_index.refresh()
+            selected_pads = select_pads(self.board_index, self.parts,
+                                        pad_filter, self.net_index)
         except Exception as e:
             debug_dialog('Something went wrong while selecting pads!', e)
 
         # Return the selected pads.
         return selected_pads
 
+    def SchedulePreview(self, evt=None):
+        '''Update the live preview once the criteria have stopped changing for a while.'''
+        if evt:
+            evt.Skip()
+        if not self.preview_btn.GetValue():
+            return
+        if self.preview_timer and self.preview_timer.IsRunning():
+            self.preview_timer.Restart(PREVIEW_DELAY)
+        else:
+            self.preview_timer = wx.CallLater(PREVIEW_DELAY, self.UpdatePreview)
+
+    def UpdatePreview(self):
+        '''Highlight the pads that meet the current criteria, only touching pads that changed.'''
+        if not self.preview_btn.GetValue():
+            return
+        try:
+            pad_filter = self.GetPadFilter()
+        except (re.error, ValueError):
+            # Leave the preview as-is while the criteria are being typed.
+            return
+        self.board_index.refresh()
+        selected_pads = select_pads(self.board_index, self.parts, pad_filter,
+                                    self.net_index)
+        with stats.timer('paint'):
+            self.previewed, changed = update_preview(self.previewed, selected_pads)
+        self.RefreshView(changed)
+
+    def ClearPreview(self):
+        '''Remove the highlighting applied by the live preview.'''
+        with stats.timer('paint'):
+            self.previewed, changed = update_preview(self.previewed, [])
+        self.RefreshView(changed)
+
+    def OnLivePreview(self, evt):
+        '''Start or stop the live preview.'''
+        if self.preview_btn.GetValue():
+            self.UpdatePreview()
+        else:
+            self.ClearPreview()
+
+    def UpdateProfileList(self, selected=None):
+        '''Show the saved profiles with the painted ones checked.'''
+        self.profile_list.Clear()
+        names = self.profiles.names()
+        if names:
+            self.profile_list.InsertItems(names, 0)
+        for i, name in enumerate(names):
+            self.profile_list.Check(i, name in self.layers or name in self.layer_loaders)
+            if name == selected:
+                self.profile_list.SetSelection(i)
+
+    def GetSelectedProfile(self):
+        '''Return the name of the selected profile or None.'''
+        i = self.profile_list.GetSelection()
+        if i == wx.NOT_FOUND:
+            return None
+        return self.profile_list.GetString(i)
+
+    def GetNetlistFile(self):
+        '''Return the netlist file, or None if there isn't one and the pins come from the board.'''
+        netlist_file = self.netlist_file_picker.GetPath()
+        return netlist_file if os.path.isfile(netlist_file) else None
+
+    def UseDesign(self, netlist_file):
+        '''Make sure the loaded parts come from the given netlist, or from the board if it's None.'''
+        if self.ref_index is not None and self.session.netlist_file == netlist_file:
+            return
+        brd_file = GetBoard().GetFileName()
+        if netlist_file is None:
+            self.parts = self.session.parts = {}
+            self.net_index = self.session.net_index = None
+            self.ref_index = RefIndex(self.board_index.footprints)
+        else:
+            if self.session.netlist_file != netlist_file or self.net_index is None:
+                self.parts = self.session.parts = get_parts_from_netlist(netlist_file, brd_file)
+                self.net_index = self.session.net_index = get_net_index(netlist_file, brd_file)
+            self.ref_index = RefIndex(self.parts)
+        self.session.netlist_file = netlist_file
+
+    def HasRuleParts(self, rules, netlist_file):
+        '''Return True if the parts of some rules are loaded, so their pads can be found without blocking.'''
+        if netlist_file is None:
+            return True  # The pins come from the board, which has to be read in the GUI thread anyway.
+        if self.ref_index is None or self.session.netlist_file != netlist_file:
+            return False
+        for rule in rules:
+            for ref in get_rule_refs(rule, self.parts, self.ref_index):
+                if self.parts.get(ref) and getattr(self.parts[ref], 'pin_table', None) is None:
+                    return False
+        return True
+
+    def LoadRuleParts(self, rules, netlist_file, on_loaded):
+        '''Start loading the parts of some rules in the background and return the loader.
+
+        on_loaded(loader, warnings) is called once the loaded parts are in use.
+        '''
+        part_refs = []
+        for rule in rules:
+            part_refs.extend(split_list(rule.get('parts', [])))
+        loader = PartLoader(netlist_file, GetBoard().GetFileName(), part_refs, self.OnLoadProgress,
+                            lambda loader, parts, warnings: self.OnRulePartsLoaded(loader, parts, warnings, on_loaded),
+                            self.parts)
+        loader.start()
+        return loader
+
+    def OnRulePartsLoaded(self, loader, parts, warnings, on_loaded):
+        '''Use the parts loaded for some rules and hand them on.'''
+
+        # Ignore the results of loads that were cancelled.
+        if loader.cancelled.is_set():
+            return
+        self.load_status.SetLabel('')
+        self.load_gauge.SetValue(0)
+
+        # Use the new parts if they're from a different netlist than the
+        # current ones. Otherwise, just add the parts that were loaded.
+        if self.ref_index is None or self.session.netlist_file != loader.netlist_file:
+            self.parts = self.session.parts = parts
+            self.net_index = self.session.net_index = loader.net_index
+            self.ref_index = loader.ref_index
+            self.session.netlist_file = loader.netlist_file
+        else:
+            for ref in loader.part_refs:
+                if getattr(parts.get(ref), 'pin_table', None) is not None:
+                    self.parts[ref] = parts[ref]
+        on_loaded(loader, warnings)
+
+    def GetProfilePads(self, name):
+        '''Return the pads selected by a profile, reusing the stored pads if the design is unchanged.
+
+        This only blocks if the profile's parts have to be loaded, so PaintLayer()
+        loads them in the background first.
+        '''
+        netlist_file = self.GetNetlistFile()
+        brd_file = GetBoard().GetFileName()
+        try:
+            self.board_index.refresh()
+            self.UseDesign(netlist_file)
+            source = get_profile_source(netlist_file, brd_file, self.board_index,
+                                        self.profiles.get_criteria(name))
+            return get_profile_pads(self.profiles, name, self.board_index, self.parts,
+                                    self.net_index, source,
+                                    ref_index=self.ref_index)
+        except Exception as e:
+            debug_dialog('Something went wrong while selecting the pads of profile {}!'.format(name), e)
+            return []
+
+    def PaintLayer(self, name, paint=True):
+        '''Paint the pads selected by a profile, loading its parts in the background if needed.
+
+        If paint is False, the pads are only tracked because they were painted
+        the last time PadPainter was open.
+        '''
+        netlist_file = self.GetNetlistFile()
+        brd_file = GetBoard().GetFileName()
+        try:
+            self.board_index.refresh()
+            source = get_profile_source(netlist_file, brd_file, self.board_index,
+                                        self.profiles.get_criteria(name))
+            pads = find_profile_pads(self.profiles, name, self.board_index, source)
+        except (IOError, OSError) as e:
+            debug_dialog('Something went wrong while selecting the pads of profile {}!'.format(name), e)
+            return
+        if pads is None and not self.HasRuleParts([self.profiles.get_criteria(name)], netlist_file):
+            self.CancelLayerLoad(name)
+            loader = self.LoadRuleParts([self.profiles.get_criteria(name)], netlist_file,
+                                        lambda loader, warnings: self.OnLayerLoaded(name, loader, warnings))
+            self.layer_loaders[name] = (loader, paint)
+            return
+        if pads is None:
+            pads = self.GetProfilePads(name)
+        self.SetLayer(name, pads, paint)
+
+    def OnLayerLoaded(self, name, loader, warnings):
+        '''Paint the pads of a profile once its parts are loaded.'''
+
+        # Ignore the results of loads that were superseded.
+        pending = self.layer_loaders.get(name)
+        if pending is None or pending[0] is not loader:
+            return
+        del self.layer_loaders[name]
+        for msg in warnings:
+            debug_dialog(msg)
+        self.SetLayer(name, self.GetProfilePads(name), pending[1])
+
+    def CancelLayerLoad(self, name):
+        '''Stop loading the parts of a profile.'''
+        pending = self.layer_loaders.pop(name, None)
+        if pending:
+            pending[0].cancel()
+
+    def SetLayer(self, name, pads, paint=True):
+        '''Keep track of the pads of a profile, painting them unless they're already painted.'''
+        self.layers[name] = pads
+        if not paint:
+            return
+        with stats.timer('paint'):
+            changed = paint_pads(pads, True)
+        for pad in pads:
+            self.previewed.pop(id(pad), None)
+        self.RefreshView(changed)
+
+    def ClearLayer(self, name):
+        '''Clear the pads painted by a profile unless another painted profile also selects them.'''
+        self.CancelLayerLoad(name)
+        pads = self.layers.pop(name, [])
+        keep = set(id(pad) for layer in self.layers.values() for pad in layer)
+        with stats.timer('paint'):
+            changed = paint_pads([pad for pad in pads if id(pad) not in keep], False)
+        self.RefreshView(changed)
+
+    def OnSelectProfile(self, evt):
+        '''Load the criteria of the selected profile into the GUI.'''
+        name = self.GetSelectedProfile()
+        if name is not None:
+            self.SetCriteria(self.profiles.get_criteria(name))
+
+    def OnProfileLayer(self, evt):
+        '''Paint or clear the pads of a profile when it's checked or unchecked.'''
+        i = evt.GetInt()
+        name = self.profile_list.GetString(i)
+        if self.profile_list.IsChecked(i):
+            self.PaintLayer(name)
+        else:
+            self.ClearLayer(name)
+
+    def OnSaveProfile(self, evt):
+        '''Save the current criteria as a named profile.'''
+        dlg = wx.TextEntryDialog(self, 'Profile name:', 'Save Profile',
+                                 self.GetSelectedProfile() or '')
+        name = dlg.GetValue().strip() if dlg.ShowModal() == wx.ID_OK else ''
+        dlg.Destroy()
+        if not name:
+            return
+        try:
+            criteria = self.GetCriteria()
+        except ValueError as e:
+            debug_dialog('The criteria are not valid!', e)
+            return
+        self.profiles.set_criteria(name, criteria)
+        if name in self.layers:
+            # Repaint the profile with its new criteria.
+            self.ClearLayer(name)
+            self.PaintLayer(name)
+        elif self.HasRuleParts([self.profiles.get_criteria(name)], self.GetNetlistFile()):
+            # Find the profile's pads now so painting it later is immediate.
+            self.GetProfilePads(name)
+        self.profiles.save()
+        self.UpdateProfileList(name)
+
+    def OnDeleteProfile(self, evt):
+        '''Delete the selected profile and clear its pads.'''
+        name = self.GetSelectedProfile()
+        if name is None:
+            return
+        if name in self.layers or name in self.layer_loaders:
+            self.ClearLayer(name)
+        self.profiles.delete(name)
+        self.profiles.save()
+        self.UpdateProfileList()
+
     def OnPaint(self, evt):
         '''Paint the specified pads.'''
-        for pad in self.SelectPads():
-            pad.SetBrightened()
-        Refresh()
+        # A pending preview update would be for the criteria being painted anyway.
+        if self.preview_timer:
+            self.preview_timer.Stop()
+        selected_pads = self.SelectPads()
+        with stats.timer('paint'):
+            # Clear any previewed pads that the criteria no longer select
+            # before forgetting about them.
+            self.previewed, changed = update_preview(self.previewed, selected_pads)
+            changed = paint_pads(selected_pads, True) or changed
+        # The previewed pads are now painted, so the preview must not clear them.
+        self.previewed = {}
+        self.RefreshView(changed)
 
     def OnClear(self, evt):
         '''Clear the specified pads.'''
-        for pad in self.SelectPads():
-            pad.ClearBrightened()
-        Refresh()
+        selected_pads = self.SelectPads()
+        with stats.timer('paint'):
+            changed = paint_pads(selected_pads, False)
+        for pad in selected_pads:
+            self.previewed.pop(id(pad), None)
+        self.RefreshView(changed)
+
+    def OnExport(self, evt):
+        '''Save the pins of the pads selected by the criteria, or by every profile, to a CSV or JSON file.'''
+
+        # Ask which pads to export if there are profiles to choose from.
+        use_profiles = False
+        if self.profiles.names():
+            dlg = wx.SingleChoiceDialog(self, 'Export the pads selected by:', 'Export Pads',
+                                        ['Current criteria', 'All saved profiles'])
+            if dlg.ShowModal() != wx.ID_OK:
+                dlg.Destroy()
+                return
+            use_profiles = dlg.GetSelection() == 1
+            dlg.Destroy()
+
+        brd_file = GetBoard().GetFileName()
+        dlg = wx.FileDialog(self, 'Export pads', get_project_directory(),
+                            os.path.splitext(os.path.basename(brd_file))[0] + '-pads.csv',
+                            'CSV|*.csv|JSON|*.json', wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        path = dlg.GetPath() if dlg.ShowModal() == wx.ID_OK else ''
+        dlg.Destroy()
+        if not path:
+            return
+
+        if use_profiles:
+            rules = self.profiles.rules()
+        else:
+            rules = [dict(self.GetCriteria(), name='current')]
+
+        # Load the parts of the rules in the background before exporting their pads.
+        if self.export_loader:
+            self.export_loader.cancel()
+            self.export_loader = None
+        netlist_file = self.GetNetlistFile()
+        if not self.HasRuleParts(rules, netlist_file):
+            self.export_loader = self.LoadRuleParts(
+                rules, netlist_file,
+                lambda loader, warnings: self.OnExportLoaded(loader, warnings, rules, path))
+            return
+        self.ExportPads(rules, path)
+
+    def OnExportLoaded(self, loader, warnings, rules, path):
+        '''Export the pads of some rules once their parts are loaded.'''
+        if loader is not self.export_loader:
+            return
+        self.export_loader = None
+        for msg in warnings:
+            debug_dialog(msg)
+        self.ExportPads(rules, path)
+
+    def ExportPads(self, rules, path):
+        '''Save the pins of the pads selected by some rules to a CSV or JSON file.'''
+
+        # Stream the rows into the file as the pads of each rule are found.
+        brd_file = GetBoard().GetFileName()
+        try:
+            self.board_index.refresh()
+            self.UseDesign(self.GetNetlistFile())
+            rows = iter_rule_rows(brd_file, rules, self.board_index, self.parts,
+                                  self.net_index, self.ref_index)
+            fmt = 'json' if path.lower().endswith('.json') else 'csv'
+            with open(path, 'w', newline='') as out:
+                write_pad_rows(rows, out, fmt)
+        except Exception as e:
+            debug_dialog('Something went wrong while exporting the pads!', e)
+        self.UpdateStats()
+
+    def RefreshView(self, changed=True):
+        '''Redraw the PCB if any pads changed and show the updated statistics.'''
+        if changed:
+            with stats.timer('refresh'):
+                Refresh()
+        else:
+            stats.count('refresh skipped')
+        self.UpdateStats()
+
+    def UpdateStats(self):
+        '''Show the current timings and counters if the statistics panel is open.'''
+        if not self.stats_pane.IsCollapsed():
+            self.stats_text.SetLabel(stats.report())
+            self.stats_pane.GetPane().Layout()
+
+    def OnStatsPane(self, evt):
+        '''Resize the window when the statistics panel is opened or closed.'''
+        self.UpdateStats()
+        panel = self.stats_pane.GetParent()
+        panel.Layout()
+        panel.Fit()
+        self.Fit()
+
+    def OnResetStats(self, evt):
+        '''Discard the timings and counters collected so far.'''
+        stats.reset()
+        self.UpdateStats()
+
+    def OnCaptureProfile(self, evt):
+        '''Start profiling, or stop and save the profile to a file for a bug report.
+
+        Only the GUI thread is profiled, so the time spent loading parts in
+        the background shows up in the statistics but not in the profile.
+        '''
+        import cProfile
+
+        if self.profile_btn.GetValue():
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            return
+
+        self.profiler.disable()
+        dlg = wx.FileDialog(self, 'Save profile', get_project_directory(),
+                            'padpainter.prof', 'Profile|*.prof|All Files|*.*',
+                            wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if dlg.ShowModal() == wx.ID_OK:
+            try:
+                self.profiler.dump_stats(dlg.GetPath())
+            except (IOError, OSError) as e:
+                debug_dialog('Unable to save the profile!', e)
+        dlg.Destroy()
+        self.profiler = None
 
     def OnDone(self, evt):
         '''Close GUI when Done button is clicked.'''
         self.Close()
 
+    def OnClose(self, evt):
+        '''Remove any unpainted preview highlighting and remember the criteria before closing.'''
+        try:
+            self.session.criteria = self.GetCriteria()
+        except ValueError:
+            pass
+        # Profiles still loading for a restored session were already painted.
+        self.session.layers = set(self.layers) | set(
+            name for name, (_, paint) in self.layer_loaders.items() if not paint)
+        if self.loader:
+            self.loader.cancel()
+        for name in list(self.layer_loaders):
+            self.CancelLayerLoad(name)
+        if self.export_loader:
+            self.export_loader.cancel()
+        if self.preview_timer:
+            self.preview_timer.Stop()
+        if self.profiler:
+            self.profiler.disable()
+        self.ClearPreview()
+        evt.Skip()
+
 
 class PadPainter(ActionPlugin):
     def defaults(self):
@@ -591,4 +3641,9 @@ class PadPainter(ActionPlugin):
         return True
 
 
-PadPainter().register()
+# Worker processes started by the CLI re-import this module as __mp_main__
+# on platforms that spawn them, and they must not register the plugin.
+if __name__ == '__main__':
+    sys.exit(main())
+elif __name__ != '__mp_main__':
+    PadPainter().register()
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+
+# MIT license
+#
+# Copyright (C) 2018-2021 by Dave Vandenbout.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+Headless benchmarks for the netlist, library and pad-selection paths of PadPainter.
+
+A synthetic design (FPGAs with thousands of pins, a large symbol library and
+a matching netlist) is generated in a temporary directory and PadPainter is run
+against stand-ins for the pcbnew and wx modules. Usage:
+
+    python benchmarks/bench_padpainter.py [--fpgas 50] [--pins 2000] [--lib-lines 100000]
+'''
+
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Use the stand-in pcbnew and wx modules and the PadPainter in this repo.
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, 'stubs'))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import pcbnew
+import PadPainter
+
+LIB_NAME = 'bench'
+FPGA_NAME = 'FPGA_BGA'
+PIN_FUNCS = 'BBBBBBIOWWP'  # Mostly I/O with some inputs, outputs and power.
+PINS_PER_UNIT = 50  # Pins in each I/O bank.
+BGA_ROWS = [c for c in 'ABCDEFGHJKLMNPRTUVWY']  # Letters used for BGA rows.
+
+
+def bga_pin_nums(num_pins):
+    '''Return BGA-style pin numbers (A1, A2, ..., AA1, ...) for a package.'''
+    rows = BGA_ROWS + [a + b for a in BGA_ROWS for b in BGA_ROWS]
+    cols = int(num_pins ** 0.5) + 1
+    return [rows[i // cols] + str(i % cols + 1) for i in range(num_pins)]
+
+
+def write_library(lib_file, num_pins, num_lines):
+    '''Write a legacy symbol library with an FPGA symbol and filler symbols up to a number of lines.'''
+    lines = ['EESchema-LIBRARY Version 2.4', '#encoding utf-8']
+
+    # The big FPGA symbol with its pins split into banks.
+    lines.append('DEF {} U 0 40 Y Y {} L N'.format(
+        FPGA_NAME, num_pins // PINS_PER_UNIT + 1))
+    lines.append('F0 "U" 0 0 50 H V C CNN')
+    lines.append('DRAW')
+    for i, num in enumerate(bga_pin_nums(num_pins)):
+        unit = i // PINS_PER_UNIT + 1
+        func = PIN_FUNCS[i % len(PIN_FUNCS)]
+        lines.append('X IO_L{}_{} {} 0 {} 200 R 50 50 {} 1 {}'.format(
+            i, unit, num, -i * 100, unit, func))
+    lines.append('ENDDRAW')
+    lines.append('ENDDEF')
+
+    # Small two-pin symbols to pad the library out to the requested size.
+    i = 0
+    while len(lines) < num_lines:
+        lines.extend([
+            '#',
+            '# FILLER_{}'.format(i),
+            '#',
+            'DEF FILLER_{} R 0 0 N Y 1 F N'.format(i),
+            'F0 "R" 80 0 50 V V C CNN',
+            'F1 "FILLER_{}" 0 0 50 V V C CNN'.format(i),
+            'DRAW',
+            'S -40 -100 40 100 0 1 10 N',
+            'X ~ 1 0 150 50 D 50 50 1 1 P',
+            'X ~ 2 0 -150 50 U 50 50 1 1 P',
+            'ENDDRAW',
+            'ENDDEF',
+        ])
+        i += 1
+    lines.append('#End Library')
+
+    with open(lib_file, 'w') as fp:
+        fp.write('\n'.join(lines) + '\n')
+    return len(lines)
+
+
+def net_name(fpga, num):
+    '''Return the name of the net attached to a pin of an FPGA.
+
+    The FPGAs are paired up and each pin connects to the same pin on the other
+    FPGA of the pair.
+    '''
+    return '/U{}_{}'.format(fpga - fpga % 2 + 1, num)
+
+
+def write_netlist(netlist_file, num_fpgas, num_pins):
+    '''Write a netlist where each FPGA pin connects to the same pin on another FPGA.'''
+    refs = ['U{}'.format(i + 1) for i in range(num_fpgas)]
+    pin_nums = bga_pin_nums(num_pins)
+
+    with open(netlist_file, 'w') as fp:
+        fp.write('(export (version D)\n')
+        fp.write('  (design\n    (source bench.sch)\n    (tool "PadPainter benchmark"))\n')
+        fp.write('  (components\n')
+        for ref in refs:
+            fp.write('    (comp (ref {})\n'.format(ref))
+            fp.write('      (value {})\n'.format(FPGA_NAME))
+            fp.write('      (libsource (lib {}) (part {}))\n'.format(LIB_NAME, FPGA_NAME))
+            fp.write('      (tstamp 00000000))\n')
+        fp.write('  )\n')
+        fp.write('  (nets\n')
+        code = 1
+        for i in range(0, num_fpgas, 2):
+            pair = refs[i:i + 2]
+            for num in pin_nums:
+                fp.write('    (net (code {}) (name {})'.format(code, net_name(i, num)))
+                for ref in pair:
+                    fp.write('\n      (node (ref {}) (pin {}))'.format(ref, num))
+                fp.write(')\n')
+                code += 1
+        fp.write('  ))\n')
+
+
+def make_board(brd_file, num_fpgas, num_pins):
+    '''Return a stand-in board with a footprint for each FPGA and nets matching the netlist.'''
+    footprints = []
+    pin_nums = bga_pin_nums(num_pins)
+    cols = int(num_pins ** 0.5) + 1
+    pitch = 800000  # 0.8 mm BGA pitch in nanometers.
+    for i in range(num_fpgas):
+        ref = 'U{}'.format(i + 1)
+        origin = (i * 50000000, 0)
+        pads = []
+        for j, num in enumerate(pin_nums):
+            # Leave every tenth pin unconnected on the board.
+            pad_net = '' if j % 10 == 0 else net_name(i, num)
+            position = (origin[0] + (j % cols) * pitch, (j // cols) * pitch)
+            pads.append(pcbnew.PAD(num, pad_net, position))
+        footprints.append(pcbnew.FOOTPRINT(ref, pads, origin))
+    return pcbnew.BOARD(brd_file, footprints)
+
+
+def reset_caches():
+    '''Discard everything PadPainter has cached in memory.'''
+    PadPainter.netlist_caches.clear()
+    PadPainter.sym_lib_files_cache.clear()
+    PadPainter.sym_libraries.clear()
+    PadPainter.symbol_cache.clear()
+
+
+def measure(label, func, repeat, setup=None):
+    '''Print the best time and the peak memory of running a function.'''
+
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    # Measure memory in a separate run since tracing slows everything down.
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print('{:<40} {:>10.2f} ms {:>10.2f} MB'.format(
+        label, min(times) * 1000, peak / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--fpgas', type=int, default=50, help='Number of FPGAs in the design.')
+    parser.add_argument('--pins', type=int, default=2000, help='Number of pins on each FPGA.')
+    parser.add_argument('--lib-lines', type=int, default=100000, help='Number of lines in the symbol library.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to run each benchmark.')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated design files.')
+    args = parser.parse_args()
+
+    design_dir = tempfile.mkdtemp(prefix='padpainter-bench-')
+    try:
+        brd_file = os.path.join(design_dir, 'bench.kicad_pcb')
+        netlist_file = os.path.join(design_dir, 'bench.net')
+        lib_file = os.path.join(design_dir, LIB_NAME + '.lib')
+        cache_file = os.path.join(design_dir, 'bench-padpainter.cache')
+        index_dir = os.path.join(design_dir, 'index')
+        os.environ['PADPAINTER_CACHE_DIR'] = index_dir
+
+        # Generate the design.
+        num_lib_lines = write_library(lib_file, args.pins, args.lib_lines)
+        write_netlist(netlist_file, args.fpgas, args.pins)
+        with open(os.path.join(design_dir, 'sym-lib-table'), 'w') as fp:
+            fp.write('(sym_lib_table\n  (lib (name {})(type Legacy)(uri {})(options "")(descr ""))\n)\n'.format(
+                LIB_NAME, lib_file))
+        board = make_board(brd_file, args.fpgas, args.pins)
+        pcbnew.SetBoard(board)
+        pcbnew.AddLoadableBoard(board)
+        with open(netlist_file) as fp:
+            num_net_lines = sum(1 for _ in fp)
+        print('Design: {} FPGAs x {} pins, {} netlist lines, {} library lines in {}'.format(
+            args.fpgas, args.pins, num_net_lines, num_lib_lines, design_dir))
+        print('{:<40} {:>13} {:>13}'.format('Benchmark', 'Best time', 'Peak memory'))
+
+        def cold_start():
+            reset_caches()
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            shutil.rmtree(index_dir, ignore_errors=True)
+
+        refs = ['U{}'.format(i + 1) for i in range(args.fpgas)]
+        state = {}
+
+        # Netlist parsing.
+        def load_parts():
+            state['parts'] = PadPainter.get_parts_from_netlist(netlist_file, brd_file)
+        measure('netlist parts (cold)', load_parts, args.repeat, cold_start)
+        measure('netlist parts (sidecar cache)', load_parts, args.repeat, reset_caches)
+        measure('netlist parts (memory cache)', load_parts, args.repeat)
+
+        def load_nets():
+            # The net index is only built when it's first used, so force it here.
+            state['net_index'] = PadPainter.get_net_index(netlist_file, brd_file)
+            state['net_index'].nodes
+        measure('netlist nets (cold)', load_nets, args.repeat, cold_start)
+        measure('netlist nets (memory cache)', load_nets, args.repeat)
+
+        # Library lookups.
+        load_parts()
+
+        def fillin_parts():
+            for ref in refs:
+                PadPainter.fillin_part_info_from_lib(ref, state['parts'])
+        def clear_libraries():
+            PadPainter.sym_libraries.clear()
+            PadPainter.symbol_cache.clear()
+
+        def clear_library_indexes():
+            clear_libraries()
+            shutil.rmtree(index_dir, ignore_errors=True)
+
+        measure('library fill-in (cold)', fillin_parts, args.repeat, clear_library_indexes)
+        measure('library fill-in (stored index)', fillin_parts, args.repeat, clear_libraries)
+        measure('library fill-in (in memory)', fillin_parts, args.repeat)
+
+        # Adding one more part to those already loaded only looks up the new one.
+        def load_one_more():
+            loader = PadPainter.PartLoader(
+                netlist_file, brd_file, refs, lambda *a: None, lambda *a: None,
+                prev_parts={ref: state['parts'][ref] for ref in refs[:-1]})
+            loader.run()
+        measure('part loader (one new ref)', load_one_more, args.repeat)
+
+        # Board snapshot.
+        def index_board():
+            state['board_index'] = PadPainter.BoardIndex(board)
+        measure('board index (build)', index_board, args.repeat)
+        measure('board index (refresh)', lambda: state['board_index'].refresh(), args.repeat)
+
+        # Pad selection.
+        parts, board_index, net_index = state['parts'], state['board_index'], state['net_index']
+        all_units = set()
+        for ref in refs:
+            all_units |= parts[ref].units
+        all_funcs = set(PIN_FUNCS)
+
+        def select(label, *criteria, **net_criteria):
+            select_net_index = net_criteria.pop('net_index', None)
+
+            def run():
+                pad_filter = PadPainter.PadFilter(*criteria, **net_criteria)
+                state['selected'] = PadPainter.select_pads(
+                    board_index, parts, pad_filter, select_net_index)
+            measure(label, run, args.repeat)
+            print('{:<40} {:>10} pads'.format('', len(state['selected'])))
+
+        select('select all pads', refs, all_units, '.*', '.*', all_funcs, 'CU')
+        select('select I/O pads, pin regexes', refs, all_units, '^[A-D]', '_1[0-9]$', 'B', 'CU')
+        select('select unconnected pads', refs, all_units, '.*', '.*', all_funcs, 'U')
+        select('select by net regex (netlist)', refs, all_units, '.*', '.*', all_funcs, 'CU',
+               net_re='U1_', net_index=net_index)
+        select('select sharing a net with U1', refs, all_units, '.*', '.*', all_funcs, 'CU',
+               net_peers=['U1'], net_index=net_index)
+
+        # Spatial selection. The first query builds the pad grid and later ones reuse it.
+        others = [ref for ref in refs if ref != 'U2']
+        select('select pads in a region', refs, all_units, '.*', '.*', all_funcs, 'CU',
+               region=(0, 0, 5, 5))
+        select('select outer two rings of pads', refs, all_units, '.*', '.*', all_funcs, 'CU',
+               rings={0, 1})
+        select('select pads within 40 mm of U2', others, all_units, '.*', '.*', all_funcs, 'CU',
+               near_refs=['U2'], near_dist=40)
+        select('select 50 pads nearest to U2', others, all_units, '.*', '.*', all_funcs, 'CU',
+               near_refs=['U2'], nearest=50)
+
+        # Painting. Repainting pads that are already painted changes nothing.
+        all_pads = PadPainter.select_pads(board_index, parts, PadPainter.PadFilter(
+            refs, all_units, '.*', '.*', all_funcs, 'CU'))
+
+        def clear_pads():
+            PadPainter.paint_pads(all_pads, False)
+        measure('paint all pads', lambda: PadPainter.paint_pads(all_pads, True),
+                args.repeat, clear_pads)
+        measure('paint all pads (already painted)',
+                lambda: PadPainter.paint_pads(all_pads, True), args.repeat)
+
+        # Exporting. The rows are streamed, so the memory shouldn't grow with the pad count.
+        all_rule = {'name': 'all', 'parts': ','.join(refs)}
+
+        def export(fmt):
+            with open(os.devnull, 'w') as out:
+                state['exported'] = PadPainter.write_pad_rows(
+                    PadPainter.evaluate_board(brd_file, [all_rule], netlist_file), out, fmt)
+        for fmt in ('csv', 'json'):
+            measure('export all pads ({})'.format(fmt), lambda: export(fmt), args.repeat)
+            print('{:<40} {:>10} pads'.format('', state['exported']))
+    finally:
+        if args.keep:
+            print('Design files kept in ' + design_dir)
+        else:
+            shutil.rmtree(design_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+'''
+Stand-in for the parts of KiCad's pcbnew module used by PadPainter so it
+can be imported and benchmarked without KiCad.
+'''
+
+
+class ActionPlugin(object):
+    def register(self):
+        pass
+
+
+class VECTOR2I(object):
+    '''Position of a board item in internal units (nanometers).'''
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+_net_codes = {'': 0}  # Net code of each net name, like the net info list of a board.
+
+
+class NETINFO_ITEM(object):
+    def __init__(self, name):
+        self.name = name
+        self.code = _net_codes.setdefault(name, len(_net_codes))
+
+    def GetNetname(self):
+        return self.name
+
+    def GetNetCode(self):
+        return self.code
+
+
+class PAD(object):
+    def __init__(self, name, net_name, position=(0, 0), pin_function='', pin_type=''):
+        self.name = name
+        self.net = NETINFO_ITEM(net_name)
+        self.position = VECTOR2I(*position)
+        self.pin_function = pin_function
+        self.pin_type = pin_type
+        self.brightened = False
+
+    def GetName(self):
+        return self.name
+
+    def GetNet(self):
+        return self.net
+
+    def GetNetname(self):
+        return self.net.name
+
+    def GetNetCode(self):
+        return self.net.code
+
+    def SetNet(self, net):
+        self.net = net
+
+    def GetPosition(self):
+        return self.position
+
+    def GetPinFunction(self):
+        return self.pin_function
+
+    def GetPinType(self):
+        return self.pin_type
+
+    def SetBrightened(self):
+        self.brightened = True
+
+    def ClearBrightened(self):
+        self.brightened = False
+
+    def IsBrightened(self):
+        return self.brightened
+
+
+class FOOTPRINT(object):
+    def __init__(self, ref, pads, position=(0, 0)):
+        self.ref = ref
+        self.pads = pads
+        self.position = VECTOR2I(*position)
+        self.selected = False
+
+    def GetReference(self):
+        return self.ref
+
+    def Pads(self):
+        return self.pads
+
+    def GetPadCount(self):
+        return len(self.pads)
+
+    def GetPosition(self):
+        return self.position
+
+    def GetOrientationDegrees(self):
+        return 0.0
+
+    def GetLayer(self):
+        return 0
+
+    def IsSelected(self):
+        return self.selected
+
+
+class BOARD(object):
+    def __init__(self, file_name, footprints):
+        self.file_name = file_name
+        self.footprints = footprints
+        self.net_count = len(set(
+            pad.GetNetname() for fp in footprints for pad in fp.pads))
+
+    def GetFileName(self):
+        return self.file_name
+
+    def GetFootprints(self):
+        return self.footprints
+
+    def GetModules(self):
+        return self.footprints
+
+    def GetNetCount(self):
+        return self.net_count
+
+
+_board = None
+
+
+def SetBoard(board):
+    '''Make a board the one returned by GetBoard().'''
+    global _board
+    _board = board
+
+
+def GetBoard():
+    return _board
+
+
+def Refresh():
+    pass
+
+
+_loaded_boards = {}
+
+
+def LoadBoard(file_name):
+    '''Return a board previously registered with AddLoadableBoard().'''
+    return _loaded_boards[file_name]
+
+
+def AddLoadableBoard(board):
+    '''Make a board available to LoadBoard() under its file name.'''
+    _loaded_boards[board.GetFileName()] = board
@@ -0,0 +1,25 @@
+'''
+Stand-in for wxPython so PadPainter can be imported without a GUI. Any class
+or constant that's requested is created on the fly and does nothing.
+'''
+
+
+class _Widget(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return _Widget()
+
+    def __call__(self, *args, **kwargs):
+        return _Widget()
+
+
+def __getattr__(name):
+    if name.isupper():
+        return 0  # Constants such as wx.ALL or wx.EXPAND.
+    return type(name, (_Widget,), {})
+
+
+def CallAfter(func, *args, **kwargs):
+    func(*args, **kwargs)
@@ -0,0 +1,3 @@
+class FileBrowseButtonWithHistory(object):
+    def __init__(self, *args, **kwargs):
+        pass
@@ -0,0 +1,99 @@
+'''
+Test setup: PadPainter is imported with the stand-in pcbnew and wx modules
+from the benchmarks so KiCad isn't needed.
+'''
+
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks', 'stubs'))
+sys.path.insert(0, REPO_DIR)
+
+import pcbnew
+import PadPainter
+
+MM = 1000000  # Nanometers per millimeter.
+
+
+def make_footprint(ref, origin=(0, 0), cols=4, rows=4, pitch=1, net=None):
+    '''Return a footprint with a cols x rows grid of pads (A1, A2, ...) starting at an origin in mm.
+
+    Each pad is on a net named after the part and pad unless a net name is given.
+    '''
+    pads = []
+    for r in range(rows):
+        for c in range(cols):
+            name = '{}{}'.format('ABCDEFGHJKLMNPRTUVWY'[r], c + 1)
+            pad_net = net if net is not None else '{}_{}'.format(ref, name)
+            position = ((origin[0] + c * pitch) * MM, (origin[1] + r * pitch) * MM)
+            pads.append(pcbnew.PAD(name, pad_net, position))
+    return pcbnew.FOOTPRINT(ref, pads, (origin[0] * MM, origin[1] * MM))
+
+
+def move_footprint(footprint, dx, dy):
+    '''Move a footprint and its pads by an offset in mm.'''
+    footprint.position = pcbnew.VECTOR2I(footprint.position.x + dx * MM, footprint.position.y + dy * MM)
+    for pad in footprint.pads:
+        pad.position = pcbnew.VECTOR2I(pad.position.x + dx * MM, pad.position.y + dy * MM)
+
+
+def make_part(ref, pins):
+    '''Return a part with pins given as (number, name, function, unit) tuples.'''
+    part = PadPainter.Part()
+    part.ref = ref
+    part.lib, part.part, part.lib_file, part.lib_stamp = 'lib', 'part', None, None
+    part.pins = {num: PadPainter.Pin(num, name, func, unit) for num, name, func, unit in pins}
+    part.units = set(pin.unit for pin in part.pins.values())
+    part.pin_table = PadPainter.PinTable(part.pins)
+    return part
+
+
+def load_board(brd_file):
+    '''Return a board with the footprints and pad nets of a KiCad 5 PCB file.
+
+    Pad positions are offset from their footprint but not rotated with it.
+    '''
+    with open(brd_file, 'r') as fp:
+        tokens = PadPainter.tokenize_sexp(fp)
+        next(tokens)
+        pcb = PadPainter.read_sexp(tokens)
+    footprints = []
+    for module in pcb:
+        if not isinstance(module, list) or module[0] != 'module':
+            continue
+        origin = [item for item in module if isinstance(item, list) and item[0] == 'at'][0]
+        x0, y0 = float(origin[1]), float(origin[2])
+        ref = [item[2] for item in module
+               if isinstance(item, list) and item[:2] == ['fp_text', 'reference']][0]
+        pads = []
+        for pad in module:
+            if not isinstance(pad, list) or pad[0] != 'pad':
+                continue
+            at = [item for item in pad if isinstance(item, list) and item[0] == 'at'][0]
+            net = [item for item in pad if isinstance(item, list) and item[0] == 'net']
+            position = ((x0 + float(at[1])) * MM, (y0 + float(at[2])) * MM)
+            pads.append(pcbnew.PAD(pad[1], net[0][2] if net else '', position))
+        footprints.append(pcbnew.FOOTPRINT(ref, pads, (x0 * MM, y0 * MM)))
+    return pcbnew.BOARD(brd_file, footprints)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches(tmp_path, monkeypatch):
+    '''Start each test without anything cached in memory, and keep library indexes out of the real cache.'''
+    monkeypatch.setenv('PADPAINTER_CACHE_DIR', str(tmp_path / 'padpainter-cache'))
+    PadPainter.netlist_caches.clear()
+    PadPainter.pin_caches.clear()
+    PadPainter.sym_libraries.clear()
+    PadPainter.symbol_cache.clear()
+    PadPainter.stats.reset()
+    yield
+
+
+@pytest.fixture
+def design_dir():
+    '''Directory holding the example design.'''
+    return TESTS_DIR
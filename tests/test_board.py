@@ -0,0 +1,64 @@
+'''Tests of keeping the board snapshot up-to-date.'''
+
+import pcbnew
+import PadPainter
+from conftest import make_footprint
+
+
+def pad_nets(board_index, ref):
+    return dict((name, net) for name, net, _ in board_index.get_entry(ref).pads)
+
+
+def test_refresh_reuses_unchanged_entries():
+    board = pcbnew.BOARD('test.kicad_pcb', [make_footprint('U1'), make_footprint('U2', (10, 0))])
+    board_index = PadPainter.BoardIndex(board)
+    entries = dict(board_index.footprints)
+    board_index.refresh()
+    assert all(board_index.footprints[ref] is entry for ref, entry in entries.items())
+
+
+def test_refresh_finds_added_and_removed_footprints():
+    board = pcbnew.BOARD('test.kicad_pcb', [make_footprint('U1')])
+    board_index = PadPainter.BoardIndex(board)
+    board.footprints = [make_footprint('U2', (10, 0))]
+    board_index.refresh()
+    assert list(board_index.footprints) == ['U2']
+
+
+def test_refresh_sees_pad_moved_to_existing_net():
+    # Moving a pad onto a net that's already on the board doesn't change the
+    # net count, so the pad nets have to be checked for each footprint.
+    u1 = make_footprint('U1')
+    board = pcbnew.BOARD('test.kicad_pcb', [u1, make_footprint('U2', (10, 0))])
+    board_index = PadPainter.BoardIndex(board)
+    net_count = board.GetNetCount()
+
+    u1.pads[0].SetNet(pcbnew.NETINFO_ITEM('U2_A1'))
+    board_index.refresh()
+    assert board.GetNetCount() == net_count
+    assert pad_nets(board_index, 'U1')['A1'] == 'U2_A1'
+    assert pad_nets(board_index, 'U2')['A1'] == 'U2_A1'
+
+
+def test_refresh_keeps_entry_when_only_nets_change():
+    u1 = make_footprint('U1')
+    board_index = PadPainter.BoardIndex(pcbnew.BOARD('test.kicad_pcb', [u1]))
+    entry = board_index.footprints['U1']
+    u1.pads[1].SetNet(pcbnew.NETINFO_ITEM('GND'))
+    board_index.refresh()
+    assert board_index.footprints['U1'] is entry
+    assert pad_nets(board_index, 'U1')['A2'] == 'GND'
+
+
+def test_refresh_only_checks_nets_of_used_footprints(monkeypatch):
+    board = pcbnew.BOARD('test.kicad_pcb', [make_footprint('U{}'.format(i), (10 * i, 0)) for i in range(10)])
+    board_index = PadPainter.BoardIndex(board)
+    calls = []
+    get_net_code = pcbnew.PAD.GetNetCode
+    monkeypatch.setattr(pcbnew.PAD, 'GetNetCode', lambda pad: calls.append(pad) or get_net_code(pad))
+
+    board_index.refresh()
+    assert not calls
+    board_index.get_entry('U3')
+    board_index.get_entry('U3')
+    assert len(calls) == 16
@@ -0,0 +1,12 @@
+'''Tests of the command-line options.'''
+
+import pytest
+
+import PadPainter
+
+
+def test_parts_required_without_rules(capsys):
+    with pytest.raises(SystemExit) as exc:
+        PadPainter.main(['test.kicad_pcb'])
+    assert exc.value.code == 2
+    assert '--parts is required' in capsys.readouterr().err
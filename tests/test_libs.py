@@ -0,0 +1,48 @@
+'''Tests of finding the symbol library files of a design.'''
+
+import os
+
+import pytest
+
+import PadPainter
+
+
+class NetlistParts(object):
+    '''Stand-in for the netlist cache with a single part.'''
+
+    def get(self, netlist_file):
+        return {'U1': ('mylib', 'FPGA')}
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    '''Board whose project library table uses a path variable, with an empty global configuration.'''
+    monkeypatch.setenv('KICAD_CONFIG_HOME', str(tmp_path / 'config'))
+    (tmp_path / 'config').mkdir()
+    (tmp_path / 'sym-lib-table').write_text(
+        '(sym_lib_table\n  (lib (name mylib)(type Legacy)(uri ${MY_LIBS}/mylib.lib)(options "")(descr ""))\n)\n')
+    PadPainter.sym_lib_files_cache.clear()
+    yield str(tmp_path / 'test.kicad_pcb')
+    PadPainter.sym_lib_files_cache.clear()
+
+
+def test_sym_lib_files_follow_environment(project, tmp_path, monkeypatch):
+    monkeypatch.setenv('MY_LIBS', str(tmp_path / 'a'))
+    assert PadPainter.get_sym_lib_files(project)['mylib'] == str(tmp_path / 'a' / 'mylib.lib')
+    monkeypatch.setenv('MY_LIBS', str(tmp_path / 'b'))
+    assert PadPainter.get_sym_lib_files(project)['mylib'] == str(tmp_path / 'b' / 'mylib.lib')
+
+
+def test_missing_library_is_found_once_installed(project, tmp_path, monkeypatch):
+    monkeypatch.setenv('MY_LIBS', str(tmp_path / 'libs'))
+    monkeypatch.setattr(PadPainter, 'get_netlist_cache', lambda brd_file: NetlistParts())
+
+    parts = PadPainter.get_parts_from_netlist('test.net', project)
+    assert parts['U1'].lib_file is None
+
+    # The cached library table still resolves the library once its file exists.
+    os.mkdir(str(tmp_path / 'libs'))
+    (tmp_path / 'libs' / 'mylib.lib').write_text('EESchema-LIBRARY Version 2.4\n')
+    parts = PadPainter.get_parts_from_netlist('test.net', project)
+    assert parts['U1'].lib_file == str(tmp_path / 'libs' / 'mylib.lib')
+    assert PadPainter.stats.counts['sym-lib cache hit'] == 1
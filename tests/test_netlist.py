@@ -0,0 +1,87 @@
+'''Tests of the S-expression tokenizer and the netlist parsers built on it.'''
+
+import io
+
+import pytest
+
+import PadPainter
+
+OPEN, CLOSE = PadPainter.SEXP_OPEN, PadPainter.SEXP_CLOSE
+
+NETLIST = '''(export (version "E")
+  (design (source "cat.sch") (comment (text "skip (this) \\"section\\"")))
+  (components
+    (comp (ref "U1")
+      (value "FPGA")
+      (libsource (lib "FPGAs") (part "XC7A35T-CSG324") (description "FPGA"))
+      (property (name "Sheetname") (value "")))
+    (comp (ref R1) (value 10K) (libsource (lib Device) (part R)))
+    (comp (ref "#PWR01") (value "GND")))
+  (libparts
+    (libpart (lib "Device") (part "R")))
+  (nets
+    (net (code "1") (name "CLK")
+      (node (ref "U1") (pin "A1") (pinfunction "IO_L1P"))
+      (node (ref "R1") (pin "1")))
+    (net (code "2") (name "/Data \\"in\\"")
+      (node (ref "U1") (pin "B2")))))
+'''
+
+
+def tokens(text, chunk_size=1 << 16):
+    return list(PadPainter.tokenize_sexp(io.StringIO(text), chunk_size))
+
+
+def test_tokens():
+    assert tokens('(a "b c" (d))') == [OPEN, 'a', 'b c', OPEN, 'd', CLOSE, CLOSE]
+    assert tokens(' \n (x\t"")  ') == [OPEN, 'x', '', CLOSE]
+    assert tokens(r'("say \"hi\"" "a\\b")') == [OPEN, 'say "hi"', 'a\\b', CLOSE]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64])
+def test_tokens_split_across_chunks(chunk_size):
+    # Atoms, strings and escapes that straddle chunk boundaries come out whole.
+    assert tokens(NETLIST, chunk_size) == tokens(NETLIST)
+
+
+def test_read_and_skip_sexp():
+    token_iter = iter(tokens('(a (b c) (d (e)) f) (g)'))
+    assert next(token_iter) is OPEN
+    assert PadPainter.read_sexp(token_iter) == ['a', ['b', 'c'], ['d', ['e']], 'f']
+    token_iter = iter(tokens('(a (b c) (d)) (g)'))
+    next(token_iter)
+    PadPainter.skip_sexp(token_iter)
+    assert list(token_iter) == [OPEN, 'g', CLOSE]
+
+
+def test_sexp_value():
+    sexp = ['comp', ['ref', 'U1'], ['value'], 'x']
+    assert PadPainter.sexp_value(sexp, 'ref') == 'U1'
+    assert PadPainter.sexp_value(sexp, 'value') is None
+    assert PadPainter.sexp_value(sexp, 'missing') is None
+
+
+@pytest.fixture
+def netlist_file(tmp_path):
+    path = tmp_path / 'cat.net'
+    path.write_text(NETLIST)
+    return str(path)
+
+
+def test_parse_netlist(netlist_file):
+    assert PadPainter.parse_netlist(netlist_file) == {
+        'U1': ['fpgas', 'XC7A35T-CSG324'],
+        'R1': ['device', 'R'],
+        '#PWR01': None,
+    }
+
+
+def test_parse_netlist_nets(netlist_file):
+    assert PadPainter.parse_netlist_nets(netlist_file) == {
+        'CLK': [['U1', 'A1'], ['R1', '1']],
+        '/Data "in"': [['U1', 'B2']],
+    }
+
+
+def test_missing_section(netlist_file):
+    assert list(PadPainter.read_netlist_section(netlist_file, 'nothing')) == []
@@ -0,0 +1,160 @@
+'''Tests of the net index and the net criteria of pad filters.'''
+
+import os
+import shutil
+import threading
+
+import pytest
+
+import pcbnew
+import PadPainter
+from conftest import load_board, make_footprint, make_part
+
+NETS = {
+    'CLK': [['U1', 'A1'], ['U2', 'A1'], ['R1', '1']],
+    'DATA': [['U1', 'A2'], ['U2', 'A2']],
+    'unconnected-(U1-Pad3)': [['U1', 'A3']],
+    'GND': [['U2', 'B1'], ['R1', '2']],
+}
+
+
+def net_filter(**criteria):
+    return PadPainter.PadFilter(['U1'], ['1'], '.*', '.*', ['B'], 'CU', **criteria)
+
+
+@pytest.fixture
+def netlist(tmp_path, design_dir):
+    '''Return the netlist and PCB file names of a copy of the example design.'''
+    shutil.copy(os.path.join(design_dir, 'CAT.net'), str(tmp_path))
+    return str(tmp_path / 'CAT.net'), str(tmp_path / 'CAT.kicad_pcb')
+
+
+def test_net_index_connections():
+    net_index = PadPainter.NetIndex(NETS)
+    assert net_index.fanout('CLK') == 3
+    assert net_index.fanout('NONE') == 0
+    assert net_index.is_connected('U1', 'A1')
+    assert not net_index.is_connected('U1', 'A3')
+    assert not net_index.is_connected('U1', 'B9')
+    assert net_index.ref_nets['R1'] == {'CLK', 'GND'}
+
+
+@pytest.mark.parametrize('criteria, expected', [
+    ({'net_re': '^D'}, {'DATA'}),
+    ({'net_peers': ['R1']}, {'CLK', 'GND'}),
+    ({'min_fanout': 3}, {'CLK'}),
+    ({'net_peers': ['R1'], 'min_fanout': 3}, {'CLK'}),
+    ({'net_re': 'A', 'net_peers': ['U2']}, {'DATA'}),
+])
+def test_match_nets(criteria, expected):
+    pad_filter = net_filter(**criteria)
+    assert pad_filter.uses_nets
+    assert pad_filter.match_nets(PadPainter.NetIndex(NETS)) == expected
+
+
+def test_net_index_is_read_when_first_used(netlist):
+    netlist_file, brd_file = netlist
+    net_index = PadPainter.get_net_index(netlist_file, brd_file)
+    assert not net_index.is_loaded()
+    assert 'nets' not in PadPainter.get_netlist_cache(brd_file).get_entry(netlist_file)
+
+    assert net_index.fanout('Net-(CON1-Pad1)') == 2
+    assert net_index.is_loaded()
+    assert 'nets' in PadPainter.get_netlist_cache(brd_file).get_entry(netlist_file)
+
+
+def test_selection_only_reads_nets_when_needed(netlist):
+    netlist_file, brd_file = netlist
+    board_index = PadPainter.BoardIndex(pcbnew.BOARD(brd_file, [make_footprint('U1', cols=2, rows=1)]))
+    parts = {'U1': make_part('U1', [('A1', 'IO1', 'B', '1'), ('A2', 'IO2', 'B', '1')])}
+    net_index = PadPainter.get_net_index(netlist_file, brd_file)
+
+    # Without net criteria, the nets come from the board.
+    selected = list(PadPainter.iter_selected_pads(board_index, parts, net_filter(), net_index))
+    assert [net for _, _, net, _ in selected] == ['U1_A1', 'U1_A2']
+    assert not net_index.is_loaded()
+
+    # The pin states come from the pads, so they don't need the netlist either.
+    unconnected = PadPainter.PadFilter(['U1'], ['1'], '.*', '.*', ['B'], 'U')
+    assert not list(PadPainter.iter_selected_pads(board_index, parts, unconnected, net_index))
+    assert not net_index.is_loaded()
+
+    list(PadPainter.iter_selected_pads(board_index, parts, net_filter(net_re='^Net-'), net_index))
+    assert net_index.is_loaded()
+
+
+def test_unconnected_pins_of_example_design(design_dir):
+    # The example netlist puts each unconnected pin on a net of its own, so the
+    # pins whose pads have no net on the board must still count as unconnected.
+    netlist_file = os.path.join(design_dir, 'CAT.net')
+    board = load_board(os.path.join(design_dir, 'CAT.kicad_pcb'))
+    board_index = PadPainter.BoardIndex(board)
+    net_index = PadPainter.NetIndex(PadPainter.parse_netlist_nets(netlist_file))
+    assert net_index.fanout(net_index.pin_nets[('U4', 'N14')]) == 1
+    assert not net_index.is_connected('U4', 'N14')
+    assert net_index.is_connected('U4', 'N13')
+
+    entry = board_index.footprints['U4']
+    parts = {'U4': make_part('U4', [(name, name, 'B', '1') for name, _, _ in entry.pads])}
+    expected = set(name for name, net, _ in entry.pads if not net)
+    assert 'N14' in expected
+    for pin_index in (None, net_index):
+        unconnected = PadPainter.PadFilter(['U4'], ['1'], '.*', '.*', ['B'], 'U')
+        selected = PadPainter.iter_selected_pads(board_index, parts, unconnected, pin_index)
+        assert set(pin.num for _, pin, _, _ in selected) == expected
+
+
+def test_netlist_cache_shared_by_threads(netlist):
+    netlist_file, brd_file = netlist
+    errors = []
+
+    def load():
+        try:
+            cache = PadPainter.get_netlist_cache(brd_file)
+            cache.get(netlist_file)
+            cache.get_nets(netlist_file)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(PadPainter.netlist_caches) == 1
+    assert PadPainter.stats.counts['netlist cache miss'] == 1
+
+    # The sidecar file is complete and no temporary files are left behind.
+    PadPainter.netlist_caches.clear()
+    cache = PadPainter.get_netlist_cache(brd_file)
+    assert set(cache.entries[os.path.abspath(netlist_file)]) >= {'parts', 'nets'}
+    assert not [name for name in os.listdir(os.path.dirname(brd_file)) if name.endswith('.tmp')]
+
+
+def test_netlist_cache_not_locked_while_parsing(netlist, monkeypatch):
+    netlist_file, brd_file = netlist
+    cache = PadPainter.get_netlist_cache(brd_file)
+    parsing, release = threading.Event(), threading.Event()
+    parse_netlist = PadPainter.parse_netlist
+
+    def slow_parse(file_name):
+        parsing.set()
+        release.wait(5)
+        return parse_netlist(file_name)
+
+    monkeypatch.setattr(PadPainter, 'parse_netlist', slow_parse)
+    loader = threading.Thread(target=cache.get, args=(netlist_file,))
+    loader.start()
+    try:
+        assert parsing.wait(5)
+        # The hash of the netlist can be looked up while its parts are being parsed.
+        looked_up = []
+        lookup = threading.Thread(target=lambda: looked_up.append(cache.get_entry(netlist_file)['hash']))
+        lookup.start()
+        lookup.join(2)
+        assert looked_up
+    finally:
+        release.set()
+        loader.join()
+    assert 'parts' in cache.get_entry(netlist_file)
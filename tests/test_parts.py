@@ -0,0 +1,119 @@
+'''Tests of part reference patterns and of getting parts and profiles from the board without a netlist.'''
+
+import pytest
+
+import pcbnew
+import PadPainter
+from conftest import make_footprint, move_footprint
+
+REFS = ['U1', 'U2', 'U10', 'U11', 'U100', 'J1', 'J2', 'JP1', 'R1', 'R12', 'C1']
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('U1', ['U1']),
+    ('U99', ['U99']),  # Exact references are kept even if they aren't known.
+    ('J*', ['J1', 'J2', 'JP1']),
+    ('J?', ['J1', 'J2']),
+    ('U1?', ['U10', 'U11']),
+    ('R[0-9]', ['R1']),
+    ('U[0-9]+', ['U1', 'U2', 'U10', 'U11', 'U100']),
+    ('U1.*', ['U1', 'U10', 'U11', 'U100']),
+    ('(R|C)1', ['C1', 'R1']),
+    ('J.?', ['J1', 'J2']),
+    ('X*', []),
+])
+def test_ref_patterns(pattern, expected):
+    assert PadPainter.RefIndex(REFS).match(pattern) == expected
+
+
+def test_ref_expand_keeps_order_without_duplicates():
+    ref_index = PadPainter.RefIndex(REFS)
+    assert ref_index.expand(['R*', 'U1', 'U[12]', 'R1']) == ['R1', 'R12', 'U1', 'U2']
+
+
+def board_footprint(ref):
+    pads = [
+        pcbnew.PAD('1', 'VCC', pin_function='VCC', pin_type='power_in'),
+        pcbnew.PAD('2', 'SDA', pin_function='SDA', pin_type='bidirectional'),
+        pcbnew.PAD('3', '', pin_function='NC', pin_type='no_connect+no_connect'),
+        pcbnew.PAD('MH', ''),  # Mounting hole with no pin.
+    ]
+    return pcbnew.FOOTPRINT(ref, pads)
+
+
+def test_parts_from_board():
+    board_index = PadPainter.BoardIndex(pcbnew.BOARD('test.kicad_pcb', [board_footprint('U1')]))
+    warnings = []
+    parts = PadPainter.get_parts_from_board(board_index, ['U1', 'U9'], warnings.append)
+    assert warnings == ['U9 was not found on the board!']
+    pins = parts['U1'].pins
+    assert sorted(pins) == ['1', '2', '3']
+    assert [(pins[n].name, pins[n].func, pins[n].unit) for n in ('1', '2', '3')] == [
+        ('VCC', 'W', PadPainter.BOARD_UNIT),
+        ('SDA', 'B', PadPainter.BOARD_UNIT),
+        ('NC', 'N', PadPainter.BOARD_UNIT),
+    ]
+
+
+def test_parts_with_same_pins_share_pin_table():
+    board_index = PadPainter.BoardIndex(pcbnew.BOARD('test.kicad_pcb', [board_footprint('U1'), board_footprint('U2')]))
+    parts = PadPainter.get_parts_from_board(board_index, ['U1', 'U2'], pytest.fail)
+    assert parts['U1'].pin_table is parts['U2'].pin_table
+
+    # Pins of the same symbol rebuilt elsewhere (e.g., from the pin cache) share it too.
+    pins = dict((num, PadPainter.Pin(pin.num, pin.name, pin.func, pin.unit))
+                for num, pin in parts['U1'].pins.items())
+    assert PadPainter.get_pin_table(pins) is parts['U1'].pin_table
+    pins['1'] = PadPainter.Pin('1', 'VDD', 'W', PadPainter.BOARD_UNIT)
+    assert PadPainter.get_pin_table(pins) is not parts['U1'].pin_table
+
+
+def test_profile_pads_without_netlist(tmp_path):
+    brd_file = tmp_path / 'test.kicad_pcb'
+    brd_file.write_text('')
+    brd_file = str(brd_file)
+    board_index = PadPainter.BoardIndex(pcbnew.BOARD(brd_file, [board_footprint('U1'), board_footprint('U2')]))
+    ref_index = PadPainter.RefIndex(board_index.footprints)
+    profiles = PadPainter.get_paint_profiles(brd_file)
+    profiles.set_criteria('io', {'parts': 'U*', 'funcs': ['I/O']})
+
+    source = PadPainter.get_profile_source(None, brd_file, board_index, profiles.get_criteria('io'))
+    assert source[0] is None
+    parts = {}
+    pads = PadPainter.get_profile_pads(profiles, 'io', board_index, parts, None, source,
+                                       warn=pytest.fail, ref_index=ref_index)
+    assert sorted(pad.GetName() for pad in pads) == ['2', '2']
+    assert sorted(parts) == ['U1', 'U2']
+
+    # The second time, the stored pads are used without getting any parts.
+    assert len(PadPainter.get_profile_pads(profiles, 'io', board_index, {}, None, source,
+                                           warn=pytest.fail, ref_index=ref_index)) == 2
+    assert PadPainter.stats.counts['profile pads hit'] == 1
+
+
+def test_profile_source_follows_board_edits():
+    u1 = make_footprint('U1')
+    u2 = make_footprint('U2', (10, 0))
+    board_index = PadPainter.BoardIndex(pcbnew.BOARD('test.kicad_pcb', [u1, u2, make_footprint('R1', (20, 0))]))
+    criteria = {'parts': 'U1', 'near': 'U2', 'near_dist': '8'}
+
+    def source():
+        board_index.refresh()
+        return PadPainter.get_profile_source(None, 'test.kicad_pcb', board_index, criteria)
+
+    # Moving or rewiring the profile's parts changes the source, but other parts don't matter.
+    first = source()
+    move_footprint(u2, 5, 0)
+    moved = source()
+    assert moved != first
+    u1.pads[0].SetNet(pcbnew.NETINFO_ITEM('GND'))
+    rewired = source()
+    assert rewired != moved
+    board_index.footprints['R1'].footprint.pads[0].SetNet(pcbnew.NETINFO_ITEM('GND'))
+    assert source() == rewired
+
+    # Without a netlist, counting the pins on each net depends on every footprint.
+    criteria['min_fanout'] = '2'
+    counted = source()
+    board_index.footprints['R1'].footprint.pads[1].SetNet(pcbnew.NETINFO_ITEM('VCC'))
+    assert source() != counted
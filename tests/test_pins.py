@@ -0,0 +1,66 @@
+'''Tests of the pin tables of parts and matching pins against the criteria.'''
+
+import pytest
+
+import PadPainter
+from conftest import make_part
+
+PINS = [
+    ('A1', 'IO_L1P', 'bidirectional', '1'),
+    ('A2', 'IO_L1N', 'bidirectional', '1'),
+    ('B1', 'VCCO_1', 'power_in', '1'),
+    ('C1', 'IO_L2P', 'bidirectional', '2'),
+    ('C2', 'GND', 'power_in', '2'),
+    ('D1', 'TCK', 'input', '3'),
+]
+
+ALL_FUNCS = ['bidirectional', 'power_in', 'input']
+
+
+def pin_filter(units=('1', '2', '3'), num_re='.*', name_re='.*', funcs=ALL_FUNCS):
+    return PadPainter.PadFilter(['U1', 'U2'], units, num_re, name_re, funcs, 'CU')
+
+
+def test_pin_table_columns_and_groups():
+    table = make_part('U1', PINS).pin_table
+    assert table.nums == tuple(num for num, _, _, _ in PINS)
+    assert table.names == tuple(name for _, name, _, _ in PINS)
+    assert table.groups[('1', 'bidirectional')] == (0, 1)
+    assert table.groups[('2', 'power_in')] == (4,)
+    assert sum(len(rows) for rows in table.groups.values()) == len(PINS)
+
+
+def test_pin_strings_are_shared():
+    # Build the strings at runtime so they aren't already shared constants.
+    func = ''.join(['power', '_in'])
+    pins = [PadPainter.Pin('1', 'A', func, '1'), PadPainter.Pin('2', 'B', 'power_' + 'in', '1')]
+    assert pins[0].func is pins[1].func
+
+
+@pytest.mark.parametrize('criteria, expected', [
+    ({}, {'A1', 'A2', 'B1', 'C1', 'C2', 'D1'}),
+    ({'units': ['2']}, {'C1', 'C2'}),
+    ({'funcs': ['power_in']}, {'B1', 'C2'}),
+    ({'num_re': '^A'}, {'A1', 'A2'}),
+    ({'name_re': r'^IO_L\d+P$'}, {'A1', 'C1'}),
+    ({'units': ['1'], 'funcs': ['bidirectional'], 'name_re': 'N$'}, {'A2'}),
+    ({'units': []}, set()),
+])
+def test_match_pins(criteria, expected):
+    assert pin_filter(**criteria).match_pins(make_part('U1', PINS).pin_table, 'U1') == expected
+
+
+def test_match_pins_with_part_units():
+    # Units qualified with a reference only apply to that part.
+    pad_filter = pin_filter(units=['1', 'U2:3'])
+    table = make_part('U1', PINS).pin_table
+    assert pad_filter.match_pins(table, 'U1') == {'A1', 'A2', 'B1'}
+    assert pad_filter.match_pins(table, 'U2') == {'D1'}
+
+
+def test_match_pins_reused_for_shared_table():
+    pad_filter = pin_filter(funcs=['input'])
+    table = make_part('U1', PINS).pin_table
+    matched = pad_filter.match_pins(table, 'U1')
+    assert pad_filter.match_pins(table, 'U2') is matched
+    assert len(pad_filter.matches) == 1
@@ -0,0 +1,103 @@
+'''Tests of the pad positions, rings, grid and distance queries.'''
+
+import math
+import random
+
+import pcbnew
+import PadPainter
+from conftest import make_footprint, move_footprint
+
+
+def space_filter(refs, **criteria):
+    return PadPainter.PadFilter(refs, [], '.*', '.*', [], 'CU', **criteria)
+
+
+def pad_names(board_index, pad_ids, refs=None):
+    '''Return the (reference, pad name) of the pads with the given ids, optionally only for some parts.'''
+    return sorted(
+        (ref, name)
+        for ref, entry in board_index.footprints.items() if refs is None or ref in refs
+        for name, _, pad in entry.pads if id(pad) in pad_ids
+    )
+
+
+def test_pad_rings_of_grid():
+    positions = [(c * 0.8, r * 0.8) for r in range(4) for c in range(5)]
+    rings = PadPainter.get_pad_rings(positions, (0, 0, 0.0, 0))
+    assert rings == [0, 0, 0, 0, 0,
+                     0, 1, 1, 1, 0,
+                     0, 1, 1, 1, 0,
+                     0, 0, 0, 0, 0]
+
+
+def test_pad_rings_of_rotated_grid():
+    angle = math.radians(30)
+    c, s = math.cos(angle), math.sin(angle)
+    positions = []
+    for j in range(4):
+        for i in range(5):
+            x, y = i * 0.8, j * 0.8
+            positions.append((10 + x * c + y * s, 20 - x * s + y * c))
+    rings = PadPainter.get_pad_rings(positions, (10 * 1e6, 20 * 1e6, 30.0, 0))
+    assert rings == PadPainter.get_pad_rings(
+        [(i * 0.8, j * 0.8) for j in range(4) for i in range(5)], (0, 0, 0.0, 0))
+
+
+def test_grid_rect_matches_scan():
+    rnd = random.Random(1)
+    items = [(rnd.uniform(-50, 50), rnd.uniform(-50, 50), object()) for _ in range(500)]
+    grid = PadPainter.PadGrid(items)
+    for rect in [(-10, -10, 10, 10), (40, 40, -40, -40), (-1000, -1000, 1000, 1000), (60, 60, 70, 70)]:
+        x0, x1 = min(rect[0], rect[2]), max(rect[0], rect[2])
+        y0, y1 = min(rect[1], rect[3]), max(rect[1], rect[3])
+        expected = set(id(item) for item in items if x0 <= item[0] <= x1 and y0 <= item[1] <= y1)
+        assert set(id(item) for item in grid.in_rect(*rect)) == expected
+
+
+def test_point_sweep_matches_scan():
+    rnd = random.Random(2)
+    points = [(rnd.uniform(0, 20), rnd.uniform(0, 20)) for _ in range(200)]
+    sweep = PadPainter.PointSweep(points)
+    for _ in range(100):
+        x, y = rnd.uniform(-10, 30), rnd.uniform(-10, 30)
+        best = min((px - x) ** 2 + (py - y) ** 2 for px, py in points)
+        assert abs(sweep.distance2(x, y) - best) < 1e-9
+        assert sweep.distance2(x, y, best / 2) is None
+
+
+def test_region_and_near_queries():
+    board = pcbnew.BOARD('test.kicad_pcb', [
+        make_footprint('U1', (0, 0)),
+        make_footprint('U2', (10, 0)),
+    ])
+    board_index = PadPainter.BoardIndex(board)
+
+    in_region = space_filter(['U1', 'U2'], region=(-0.5, -0.5, 1.5, 0.5)).match_space(board_index)
+    assert pad_names(board_index, in_region) == [('U1', 'A1'), ('U1', 'A2')]
+
+    # U1's right column is 7 mm from U2's left column.
+    near = space_filter(['U1'], near_refs=['U2'], near_dist=7).match_space(board_index)
+    assert pad_names(board_index, near, ['U1']) == [('U1', r + '4') for r in 'ABCD']
+
+    nearest = space_filter(['U1'], near_refs=['U2'], nearest=2)
+    pads = [pad for _, _, pad in board_index.footprints['U1'].pads]
+    picked = nearest.nearest_pads(board_index, pads)
+    assert len(picked) == 2
+    assert set(name for _, name in pad_names(board_index, picked)) <= set(r + '4' for r in 'ABCD')
+
+
+def test_region_follows_moved_footprint():
+    u1 = make_footprint('U1', (0, 0))
+    board = pcbnew.BOARD('test.kicad_pcb', [u1, make_footprint('U2', (10, 0))])
+    board_index = PadPainter.BoardIndex(board)
+    region = (0, 0, 5, 5)
+    assert len(space_filter(['U1'], region=region).match_space(board_index)) == 16
+
+    # See the move through the rings query first, then check the region
+    # query doesn't keep using the old positions.
+    move_footprint(u1, 100, 0)
+    board_index.refresh()
+    space_filter(['U1'], rings={0}, region=region).match_space(board_index)
+    assert not space_filter(['U1'], region=region).match_space(board_index)
+    moved = space_filter(['U1'], region=(100, 0, 105, 5)).match_space(board_index)
+    assert len(moved) == 16
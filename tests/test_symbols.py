@@ -0,0 +1,139 @@
+'''Tests of indexing symbol libraries, reading their symbols and caching them.'''
+
+import os
+import shutil
+
+import pytest
+
+import PadPainter
+
+KICAD_SYM = '''(kicad_symbol_lib (version 20211014) (generator kicad_symbol_editor)
+  (symbol "OpAmp_Dual" (in_bom yes) (on_board yes)
+    (property "Reference" "U" (id 0) (at 0 5.08 0))
+    (symbol "OpAmp_Dual_0_1"
+      (pin power_in line (at -2.54 7.62 270) (length 3.81) (name "V+" (effects (font (size 1.27 1.27)))) (number "8"))
+      (pin power_in line (at -2.54 -7.62 90) (length 3.81) (name "V-") (number "4")))
+    (symbol "OpAmp_Dual_1_1"
+      (pin output line (at 7.62 0 180) (length 2.54) (name "~") (number "1"))
+      (pin input line (at -7.62 -2.54 0) (length 2.54) (name "-") (number "2"))
+      (pin input line (at -7.62 2.54 0) (length 2.54) (name "+") (number "3")))
+    (symbol "OpAmp_Dual_2_1"
+      (pin output line (at 7.62 0 180) (length 2.54) (name "~") (number "7"))
+      (pin input line (at -7.62 -2.54 0) (length 2.54) (name "-") (number "6"))
+      (pin input line (at -7.62 2.54 0) (length 2.54) (name "+") (number "5"))))
+  (symbol "LM358" (extends "OpAmp_Dual")
+    (property "Reference" "U" (id 0) (at 0 5.08 0)))
+  (symbol "R"
+    (symbol "R_0_1"
+      (pin passive line (at 0 3.81 270) (length 1.27) (name "~") (number "1"))
+      (pin passive line (at 0 -3.81 90) (length 1.27) (name "~") (number "2"))))
+  (symbol "R_Small"
+    (symbol "R_Small_1_1"
+      (pin passive line (at 0 2.54 270) (length 0.762) (name "~") (number "1"))))
+)
+'''
+
+
+def pin_info(symbol):
+    return dict((num, (pin.name, pin.func, pin.unit)) for num, pin in symbol.pins.items())
+
+
+@pytest.fixture
+def legacy_lib(design_dir):
+    return PadPainter.SymbolLibrary(os.path.join(design_dir, 'CAT-cache.lib'))
+
+
+@pytest.fixture
+def kicad_sym(tmp_path):
+    path = tmp_path / 'test.kicad_sym'
+    path.write_text(KICAD_SYM)
+    return PadPainter.KicadSymbolLibrary(str(path))
+
+
+def test_legacy_index(legacy_lib):
+    offsets = legacy_lib.offsets
+    # Hidden values are indexed with and without their ~, and aliases share their symbol's bytes.
+    assert offsets['~CAT-rescue:DIPSW4'] == offsets['CAT-rescue:DIPSW4']
+    assert offsets['24C512'] == offsets['XESS:EEPROM_I2C']
+    assert offsets['LD1117'] == offsets['NCV1117'] == offsets['XESS:NCV1117']
+    text = legacy_lib.read_text(*offsets['XESS:RN2'])
+    assert text.startswith('DEF XESS:RN2') and text.endswith('ENDDEF')
+
+
+def test_legacy_symbols(legacy_lib):
+    assert pin_info(legacy_lib.get_symbol('XESS:RN2')) == {
+        '1': ('~', 'P', '1'), '4': ('~', 'P', '1'),
+        '2': ('~', 'P', '2'), '3': ('~', 'P', '2'),
+    }
+    eeprom = legacy_lib.get_symbol('24C512')
+    assert eeprom is legacy_lib.get_symbol('XESS:EEPROM_I2C')
+    assert eeprom.units == {'0', '1'}
+    assert pin_info(eeprom)['4'] == ('GND', 'W', '0')
+    assert pin_info(eeprom)['5'] == ('SDA', 'B', '1')
+    assert legacy_lib.get_symbol('NOT_THERE') is None
+
+
+def test_kicad_sym_index(kicad_sym):
+    # Units nested in a symbol aren't indexed, but symbols that only start with its name are.
+    assert sorted(kicad_sym.offsets) == ['LM358', 'OpAmp_Dual', 'R', 'R_Small']
+    assert kicad_sym.read_text(*kicad_sym.offsets['R']).lstrip().startswith('(symbol "R"')
+
+
+def test_kicad_sym_units_and_extends(kicad_sym):
+    opamp = kicad_sym.get_symbol('OpAmp_Dual')
+    assert opamp.units == {'0', '1', '2'}
+    assert pin_info(opamp)['8'] == ('V+', 'W', '0')
+    assert pin_info(opamp)['1'] == ('~', 'O', '1')
+    assert pin_info(opamp)['5'] == ('+', 'I', '2')
+
+    # A derived symbol has the pins of the symbol it extends.
+    assert pin_info(kicad_sym.get_symbol('LM358')) == pin_info(opamp)
+    assert pin_info(kicad_sym.get_symbol('R_Small')) == {'1': ('~', 'P', '1')}
+    assert pin_info(kicad_sym.get_symbol('R')) == {'1': ('~', 'P', '0'), '2': ('~', 'P', '0')}
+
+
+def test_index_is_stored_and_rebuilt_when_stale(tmp_path, design_dir):
+    lib_file = str(tmp_path / 'CAT-cache.lib')
+    shutil.copy(os.path.join(design_dir, 'CAT-cache.lib'), lib_file)
+
+    sym_lib = PadPainter.get_symbol_library(lib_file)
+    assert PadPainter.stats.counts['library index miss'] == 1
+    assert os.path.dirname(sym_lib.index_file()) == str(tmp_path / 'padpainter-cache')
+    assert os.path.isfile(sym_lib.index_file())
+
+    # A new index object loads the stored index instead of scanning the library.
+    PadPainter.sym_libraries.clear()
+    reloaded = PadPainter.get_symbol_library(lib_file)
+    assert reloaded is not sym_lib and reloaded.offsets == sym_lib.offsets
+    assert PadPainter.stats.counts['library index hit'] == 1
+    assert PadPainter.get_symbol_library(lib_file) is reloaded
+
+    # Changing the library makes both the loaded and the stored index stale.
+    with open(lib_file, 'a') as fp:
+        fp.write('DEF NEW U 0 40 Y Y 1 F N\nX A 1 0 0 100 R 50 50 1 1 I\nENDDEF\n')
+    assert reloaded.is_stale()
+    rebuilt = PadPainter.get_symbol_library(lib_file)
+    assert rebuilt is not reloaded
+    assert PadPainter.stats.counts['library index miss'] == 2
+    assert pin_info(rebuilt.get_symbol('NEW')) == {'1': ('A', 'I', '1')}
+
+
+def test_symbol_cache_evicts_least_recently_used(legacy_lib):
+    symbols = [legacy_lib.get_symbol(name) for name in ('XESS:RN2', 'XESS:RN4', 'XESS:EEPROM_I2C')]
+    sizes = [PadPainter.estimate_symbol_size(symbol) for symbol in symbols]
+    cache = PadPainter.SymbolCache(sizes[0] + sizes[1] + sizes[2] - 1)
+
+    cache.put('a', symbols[0])
+    cache.put('b', symbols[1])
+    assert cache.get('a') is symbols[0]  # Now 'b' is the least recently used.
+    cache.put('c', symbols[2])
+    assert cache.get('b') is None
+    assert cache.get('a') is symbols[0] and cache.get('c') is symbols[2]
+    assert cache.total_bytes == sizes[0] + sizes[2]
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # The newest symbol is kept even if it's bigger than the limit.
+    small = PadPainter.SymbolCache(1)
+    small.put('a', symbols[0])
+    small.put('b', symbols[1])
+    assert list(small.entries) == ['b']